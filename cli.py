@@ -0,0 +1,207 @@
+"""Command-line entry point for all bias studies.
+
+    python cli.py generate <experiment>
+    python cli.py run <experiment>
+    python cli.py retry <experiment>
+    python cli.py status [experiment ...]
+    python cli.py plan <experiment>
+    python cli.py reparse <experiment>
+    python cli.py mentions <experiment>
+    python cli.py deltas <experiment>
+    python cli.py dedup
+    python cli.py serve [--port PORT]
+    python cli.py --profile [--sample-stacks] run <experiment>
+
+Heavy modules (pandas, requests) are imported only by the subcommands that
+need them, so ``status`` stays fast enough for cron jobs and shell loops.
+"""
+import argparse
+import importlib
+import sys
+
+# experiment -> (pipeline module, prompt generator, prompts file setting, results file setting)
+EXPERIMENTS = {
+    'age': ('pipelines.age_pipeline', 'generate_age_prompts', 'AGE_PROMPTS_FILE', 'AGE_RESULTS_FILE'),
+    'gender': ('pipelines.gender_pipeline', 'generate_gender_prompts', 'GENDER_PROMPTS_FILE', 'GENDER_RESULTS_FILE'),
+    'location': ('pipelines.location_pipeline', 'generate_location_prompts', 'LOCATION_PROMPTS_FILE', 'LOCATION_RESULTS_FILE'),
+    'rate': ('pipelines.rate_pipeline', 'generate_rate_prompts', 'RATE_PROMPTS_FILE', 'RATE_RESULTS_FILE'),
+    'interaction': ('pipelines.interaction_pipeline', 'generate_interaction_prompts', 'INTERACTION_PROMPTS_FILE', 'INTERACTION_RESULTS_FILE'),
+}
+
+
+def load_pipeline(experiment: str):
+    """Import a pipeline module on demand."""
+    return importlib.import_module(EXPERIMENTS[experiment][0])
+
+
+def cmd_generate(args):
+    """Generate prompts for an experiment."""
+    pipeline = load_pipeline(args.experiment)
+    getattr(pipeline, EXPERIMENTS[args.experiment][1])()
+
+
+def cmd_run(args):
+    """Generate prompts if needed and query all models."""
+    load_pipeline(args.experiment).main()
+
+
+def cmd_retry(args):
+    """Retry samples queued after transient failures, waiting for each retry to come due."""
+    import config
+    from utils.runner import run_api_processing
+
+    pipeline = load_pipeline(args.experiment)
+    config.validate_config()
+    _, _, prompts_setting, results_setting = EXPERIMENTS[args.experiment]
+    run_api_processing(getattr(config, prompts_setting), getattr(config, results_setting),
+                       pipeline.result_fields, retry_only=True)
+
+
+def cmd_reparse(args):
+    """Re-run response parsing over archived raw responses, without new API calls."""
+    import config
+    from utils.file_utils import file_exists
+    from utils.response_archive import reparse_results
+
+    results_file = getattr(config, EXPERIMENTS[args.experiment][3])
+    if not file_exists(results_file):
+        print(f"{args.experiment}: no results yet")
+        return
+    print(f"✅ Re-parsed {reparse_results(results_file):,} archived responses in {results_file}")
+
+
+def cmd_mentions(args):
+    """Flag age, gender, country and cost-of-living mentions in results and report rates."""
+    import config
+    from utils.file_utils import file_exists
+    from utils.mentions import mine_mentions
+
+    results_file = getattr(config, EXPERIMENTS[args.experiment][3])
+    if not file_exists(results_file):
+        print(f"{args.experiment}: no results yet")
+        return
+    mine_mentions(results_file)
+    print(f"✅ Row flags in {results_file}.mentions.csv, rates in {results_file}.mention_rates.csv")
+
+
+def cmd_deltas(args):
+    """Pair each result with its reference counterfactual sibling and report rate deltas."""
+    import config
+    from utils.file_utils import file_exists
+    from utils.siblings import paired_deltas
+
+    _, _, prompts_setting, results_setting = EXPERIMENTS[args.experiment]
+    prompts_file, results_file = getattr(config, prompts_setting), getattr(config, results_setting)
+    if not file_exists(results_file):
+        print(f"{args.experiment}: no results yet")
+        return
+    paired_deltas(prompts_file, results_file)
+    print(f"✅ Paired deltas in {results_file}.deltas.csv")
+
+
+def cmd_dedup(args):
+    """Report near-duplicate profile clusters in the data directory."""
+    import config
+    from utils.data_loader import load_csv_data
+    from utils.dedup import deduplicate
+
+    config.DEDUP_PROFILES = False
+    deduplicate(load_csv_data())
+
+
+def cmd_serve(args):
+    """Serve interactive bias audits of single profiles over HTTP."""
+    import config
+    from services.audit import serve
+
+    config.validate_config()
+    serve(args.host, args.port)
+
+
+def cmd_status(args):
+    """Print per-model completion counts from progress metadata."""
+    import config
+    from utils.progress import load_progress
+
+    for experiment in args.experiments or EXPERIMENTS:
+        progress = load_progress(getattr(config, EXPERIMENTS[experiment][3]))
+        if not progress:
+            print(f"{experiment}: no runs yet")
+            continue
+
+        prompts = progress.get('prompts')
+        expected = prompts * progress.get('samples_per_task', 1) if prompts else None
+        print(f"{experiment}: {prompts if prompts else '?'} prompts, updated {progress.get('updated', '?')}")
+        for model in sorted(progress.get('models', {})):
+            counts = progress['models'][model]
+            done = counts['success'] + counts['failed']
+            total = f"/{expected:,} ({done / expected * 100:.1f}%)" if expected else ""
+            print(f"  {model}: {done:,}{total} | ✅ {counts['success']:,} | ❌ {counts['failed']:,}")
+
+
+def cmd_plan(args):
+    """Show how many prompts, tasks and requests a run would still need."""
+    import pandas as pd
+    import config
+    from utils.file_utils import file_exists, load_sample_counts
+    from services.openrouter import supports_n
+
+    prompts_file = getattr(config, EXPERIMENTS[args.experiment][2])
+    results_file = getattr(config, EXPERIMENTS[args.experiment][3])
+    if not file_exists(prompts_file):
+        print(f"{args.experiment}: {prompts_file} not generated yet (run `python cli.py generate {args.experiment}`)")
+        return
+
+    prompts = len(pd.read_csv(prompts_file, usecols=['prompt']))
+    sample_counts = load_sample_counts(results_file)
+    samples = config.SAMPLES_PER_TASK
+
+    print(f"{args.experiment}: {prompts:,} prompts x {len(config.MODELS)} models x {samples} samples")
+    for model in config.MODELS:
+        stored = [min(count, samples) for (_, m), count in sample_counts.items() if m == model]
+        missing_samples = prompts * samples - sum(stored)
+        missing_tasks = prompts - len([count for count in stored if count >= samples])
+        requests = missing_tasks if supports_n(model) else missing_samples
+        route = "batch" if config.BATCH_MODE and model in config.BATCH_MODELS else "sync"
+        print(f"  {model} [{route}]: {missing_tasks:,} tasks, {missing_samples:,} samples, ~{requests:,} requests pending")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generative pricing bias studies")
+    parser.add_argument('--profile', action='store_true', help="time pipeline stages and report them at exit")
+    parser.add_argument('--sample-stacks', action='store_true', help="with --profile, also write a flame-graph stack file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name, handler in (('generate', cmd_generate), ('run', cmd_run), ('retry', cmd_retry), ('plan', cmd_plan), ('reparse', cmd_reparse),
+                          ('mentions', cmd_mentions), ('deltas', cmd_deltas)):
+        sub = subparsers.add_parser(name, help=handler.__doc__)
+        sub.add_argument('experiment', choices=EXPERIMENTS)
+        sub.set_defaults(handler=handler)
+
+    sub = subparsers.add_parser('dedup', help=cmd_dedup.__doc__)
+    sub.set_defaults(handler=cmd_dedup)
+
+    sub = subparsers.add_parser('serve', help=cmd_serve.__doc__)
+    sub.add_argument('--host', help="default config.AUDIT_HOST")
+    sub.add_argument('--port', type=int, help="default config.AUDIT_PORT")
+    sub.set_defaults(handler=cmd_serve)
+
+    sub = subparsers.add_parser('status', help=cmd_status.__doc__)
+    sub.add_argument('experiments', nargs='*', metavar='experiment', help=f"any of {', '.join(EXPERIMENTS)}")
+    sub.set_defaults(handler=cmd_status)
+
+    args = parser.parse_args(argv)
+    unknown = [e for e in getattr(args, 'experiments', []) if e not in EXPERIMENTS]
+    if unknown:
+        parser.error(f"unknown experiment(s): {', '.join(unknown)}")
+    if args.profile:
+        import config
+        from utils.profiling import start
+        config.PROFILE = True
+        config.PROFILE_SAMPLER = args.sample_stacks
+        start()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,22 +6,160 @@ load_dotenv()
 
 # API Configuration
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
+# Extra keys for the key pool: comma-separated in OPENROUTER_API_KEYS and/or one
+# per line in OPENROUTER_KEYS_FILE; requests are spread over all of them
+OPENROUTER_API_KEYS = [key.strip() for key in os.getenv('OPENROUTER_API_KEYS', '').split(',') if key.strip()]
+OPENROUTER_KEYS_FILE = os.getenv('OPENROUTER_KEYS_FILE', 'openrouter_keys.txt')
 SITE_URL = os.getenv('YOUR_SITE_URL', 'https://localhost')
 SITE_NAME = os.getenv('YOUR_SITE_NAME', 'Bias Analysis Research')
 
+# Batch API (OpenAI-compatible /files and /batches endpoints)
+BATCH_API_BASE = os.getenv('BATCH_API_BASE', 'https://api.openai.com/v1')
+BATCH_API_KEY = os.getenv('BATCH_API_KEY', os.getenv('OPENAI_API_KEY'))
+
 # Processing Configuration
 MAX_WORKERS = 50
 BATCH_SIZE = 100
+MAX_IN_FLIGHT = MAX_WORKERS * 2  # Tasks submitted to the worker pool at any time
+PROMPT_CHUNK_SIZE = 5000  # Prompt rows read from disk at a time
+RESULTS_CHUNK_SIZE = 50000  # Result rows rewritten at a time when compacting retries
+TASK_ORDER = 'file'  # 'file', 'longest_first', 'balanced' or 'coverage' (see README)
+LENGTH_BUCKETS = 4  # Cost buckets interleaved by TASK_ORDER = 'balanced'
+# Prompt variation and counterfactual value columns of the studies, used to
+# interleave a freelancer's siblings (TASK_ORDER = 'coverage'), to group mention
+# rates and to pair siblings in the sibling index
+PROMPT_VARIATION_COLUMNS = ['prompt_variation', 'version']
+COUNTERFACTUAL_COLUMNS = ['age', 'gender_variation', 'modified_location',
+                          'age_variation', 'location_variation']
+VARIATION_COLUMNS = PROMPT_VARIATION_COLUMNS + COUNTERFACTUAL_COLUMNS
 API_TIMEOUT = 30
 MAX_RETRIES = 3
 RATE_LIMIT_BACKOFF = 120
 
+# API key pool: each key's remaining credit is read from OpenRouter every
+# KEY_REFRESH_SECONDS (None = never) and lowered by the cost of each response
+KEY_REFRESH_SECONDS = 300
+KEY_MIN_REMAINING = 0.5  # USD; keys with less left sit out until a refresh shows more
+KEY_COOLDOWN = 30  # Seconds a key sits out after a 429 or KEY_FAILURE_LIMIT errors in a row, doubled while it keeps failing
+KEY_MAX_COOLDOWN = 600
+KEY_FAILURE_LIMIT = 3
+
+# Per-model circuit breaker: stop sending tasks to a failing model, park them,
+# and probe the model again after a cooldown
+CIRCUIT_BREAKER = True
+BREAKER_WINDOW = 20  # Recent calls used for the error rate
+BREAKER_MIN_CALLS = 10
+BREAKER_ERROR_RATE = 0.5
+BREAKER_FATAL_STATUSES = ['error_401', 'error_402', 'error_403', 'error_404']  # Open immediately
+BREAKER_COOLDOWN = 60  # Seconds before the first probe, doubled after each failed probe
+BREAKER_MAX_COOLDOWN = 900
+BREAKER_MAX_PROBES = 5  # Failed probes in a row before parked tasks are left for the next run
+
+# Deferred retry queue: samples that fail with 5xx, timeouts or connection errors
+# are retried after growing delays; other 4xx errors are final
+RETRY_TRANSIENT_CODES = [408, 429]
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_DELAY = 30  # Seconds before the first retry, doubled per attempt
+RETRY_MAX_DELAY = 1800
+RETRY_MAX_WAIT = 300  # Longest a run waits for the next retry to come due before leaving it for `cli.py retry`
+
+# Near-duplicate profiles (MinHash/LSH over title, description and skills)
+DEDUP_PROFILES = False
+DEDUP_THRESHOLD = 0.8  # Estimated Jaccard similarity of word shingles
+DEDUP_NUM_PERM = 64
+DEDUP_SHINGLE_WORDS = 3
+DEDUP_CHUNK_SIZE = 50000  # Profiles shingled at a time
+DEDUP_MODE = 'flag'  # 'flag' keeps all profiles; 'representative' keeps one per cluster
+DEDUP_REPORT_FILE = "duplicate_clusters.csv"
+
+# Demographic mention mining (python cli.py mentions <experiment>): case-insensitive,
+# whole-word terms looked up in MENTION_FIELDS of every result row (archived responses
+# are read back through their response_ref). Pronouns and 'name' are left out of the
+# gender list since reasoning refers to the freelancer by them.
+MENTION_TERMS = {
+    'age': ['age', 'aged', 'years old', 'year old', 'year-old', 'young', 'younger', 'youth', 'older',
+            'elderly', 'senior citizen', 'retired', 'retirement', 'early career', 'early-career',
+            'mid-career', 'late career', 'older generation', 'younger generation', 'millennial', 'gen z', 'boomer'],
+    'gender': ['gender', 'male', 'female', 'man', 'woman', 'men', 'women', 'masculine', 'feminine',
+               'sex'],
+    'country': ['country', 'location', 'geographic', 'geographical', 'pakistan', 'pakistani',
+                'philippines', 'philippine', 'filipino', 'filipina', 'india', 'indian', 'united states',
+                'usa', 'u.s.', 'america', 'american', 'bangladesh', 'bangladeshi', 'uk', 'united kingdom',
+                'britain', 'british'],
+    'cost_of_living': ['cost of living', 'living costs', 'living cost', 'purchasing power', 'ppp',
+                       'local market', 'local rates', 'regional rates', 'low-cost', 'low cost', 'lower cost',
+                       'economic conditions', 'developing country', 'emerging market', 'offshore', 'outsourcing'],
+}
+# Phrases that contain a term but are not a mention; a match of one of these hides the
+# terms inside it (hyphens count as word boundaries, so 'man' alone matches 'man-hours')
+MENTION_EXCLUDE = ['man-hour', 'man-hours', 'man hour', 'man hours', 'man-day', 'man-days', 'man-month',
+                   'man-months', 'man-made', 'middle man']
+MENTION_FIELDS = ['reasoning', 'response']
+MENTION_CHUNK_SIZE = 100000  # Result rows per worker task
+MENTION_WORKERS = None  # Processes; None uses every core
+
+# Raw-response archive: full API responses (provider, usage, finish_reason, headers)
+# go to <results file>.archive.zst and result rows keep a response_ref instead of the text
+ARCHIVE_RESPONSES = True
+ARCHIVE_LEVEL = 6  # zstd compression level
+
+# Profiling: per-stage timers reported at exit (<PROFILE_OUTPUT>_stages.csv); the
+# sampler also writes collapsed stacks (<PROFILE_OUTPUT>.folded) for flamegraph.pl or speedscope
+PROFILE = os.getenv('PROFILE') == '1'
+PROFILE_SAMPLER = False
+PROFILE_INTERVAL = 0.01  # Seconds between stack samples
+PROFILE_OUTPUT = "profile"
+
+# Request hedging: once a call outlives the model's observed latency percentile,
+# send a duplicate and keep whichever answers first
+HEDGE_REQUESTS = False
+HEDGE_PERCENTILE = 95
+HEDGE_MIN_SAMPLES = 20  # Successful calls per model before hedging starts
+HEDGE_MAX_EXTRA_LOAD = 0.05  # Max hedged duplicates as a fraction of calls
+LATENCY_WINDOW = 500  # Recent latencies kept per model
+
+# Results journal: every result is appended to <results file>.journal as it
+# completes and compacted into the results CSV every BATCH_SIZE results or
+# JOURNAL_COMPACT_SECONDS, whichever comes first
+JOURNAL_FSYNC = True
+JOURNAL_GROUP_COMMIT = 10  # Results per journal flush/fsync
+JOURNAL_COMPACT_SECONDS = 30
+
+# Adaptive sampling: stop querying a (model, variation, counterfactual value)
+# cell once its paired-difference confidence interval is narrow enough
+ADAPTIVE_SAMPLING = False
+ADAPTIVE_CI_WIDTH = 2.0  # Full CI width in USD
+ADAPTIVE_CONFIDENCE = 0.95
+ADAPTIVE_MIN_PAIRS = 30
+SAMPLING_SEED = 42
+
+# Pilot subsampling, stratified by source file, country and hourly-rate band.
+# Set SAMPLE_SIZE (freelancers) or SAMPLE_FRACTION; leave both None for a full run.
+SAMPLE_SIZE = None
+SAMPLE_FRACTION = None
+RATE_BANDS = [0, 15, 30, 60, 100]  # Lower edges of hourly-rate bands (USD)
+
 # Models to test (specify all here)
 MODELS = [
     "meta-llama/llama-3.1-405b-instruct",
     "openai/gpt-5",
 ]
 
+# Completions collected per (prompt, model). Models matching N_SUPPORTED_PREFIXES
+# get them in one request via the `n` parameter; others use parallel repeats.
+SAMPLES_PER_TASK = 1
+N_SUPPORTED_PREFIXES = ["openai/"]
+
+# Batch mode: models listed here (OpenRouter ID -> batch provider ID) are run
+# as offline batch jobs; the remaining models still use the synchronous API
+BATCH_MODE = False
+BATCH_MODELS = {
+    "openai/gpt-5": "gpt-5",
+}
+BATCH_MAX_REQUESTS = 50000  # Requests per batch input file
+BATCH_WAIT = True  # Poll until all batches finish; otherwise collect on the next run
+BATCH_POLL_SECONDS = 60
+
 # Profile cleaning model
 PROFILE_CLEANING_MODEL = "openai/gpt-4o-mini"
 
@@ -33,6 +171,36 @@ LOCATION_COUNTRIES = [
     'Unspecified location'
 ]
 
+# Audit service (python cli.py serve): one profile's counterfactual variants
+# across MODELS per request. AUDIT_VARIATIONS limits each axis to the listed
+# prompt variations ('all' keeps every one); calls still running after
+# AUDIT_BUDGET_SECONDS are returned as pending and cached when they finish.
+AUDIT_HOST = "127.0.0.1"
+AUDIT_PORT = 8750
+AUDIT_AXES = ['age', 'gender', 'location']
+AUDIT_VARIATIONS = ['base']
+AUDIT_BUDGET_SECONDS = 10
+AUDIT_WORKERS = MAX_WORKERS
+AUDIT_CACHE_SIZE = 10000  # Cached (model, prompt) outcomes
+AUDIT_CACHE_TTL = 24 * 3600
+AUDIT_LOG_REQUESTS = False
+
+# Interaction study: counterfactual axes to cross (any of 'age', 'gender', 'location').
+# INTERACTION_MAX_ORDER limits cells to at most that many non-baseline axes
+# (1 = main effects only, 2 = two-way interactions, None = full factorial).
+INTERACTION_AXES = ['age', 'gender', 'location']
+INTERACTION_MAX_ORDER = 2
+
+# Sibling a counterfactual value is compared against in rate deltas
+# (the age study has no unspecified age, so its youngest age is the reference)
+COUNTERFACTUAL_REFERENCES = {
+    'age': AGE_VALUES[0],
+    'gender_variation': 'unspecified',
+    'modified_location': 'Unspecified location',
+    'age_variation': 'unspecified',
+    'location_variation': 'Unspecified location',
+}
+
 # File paths
 DATA_DIR = "data/"
 NAMES_FILE = "names.csv"
@@ -42,9 +210,16 @@ GENDER_PROMPTS_FILE = "gender_bias_prompts.csv"
 GENDER_RESULTS_FILE = "gender_bias_results.csv"
 LOCATION_PROMPTS_FILE = "location_bias_prompts.csv"
 LOCATION_RESULTS_FILE = "location_bias_results.csv"
+RATE_PROMPTS_FILE = "rate_prompts.csv"
+RATE_RESULTS_FILE = "rate_analysis_results.csv"
+INTERACTION_PROMPTS_FILE = "interaction_prompts.csv"
+INTERACTION_RESULTS_FILE = "interaction_results.csv"
 CLEANING_CHECKPOINT = "cleaning_checkpoint.pkl"
 
 def validate_config():
     """Validate configuration."""
-    if not OPENROUTER_API_KEY:
-        raise ValueError("OPENROUTER_API_KEY not found in environment variables")
\ No newline at end of file
+    from services.key_pool import load_keys  # key_pool imports config
+    if not load_keys():
+        raise ValueError("No OpenRouter API key found: set OPENROUTER_API_KEY, OPENROUTER_API_KEYS or list keys in OPENROUTER_KEYS_FILE")
+    if BATCH_MODE and not BATCH_API_KEY:
+        raise ValueError("BATCH_API_KEY (or OPENAI_API_KEY) not found in environment variables")
\ No newline at end of file
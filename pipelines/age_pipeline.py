@@ -1,13 +1,16 @@
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import config
-from utils.data_loader import load_csv_data
-from utils.file_utils import file_exists, save_to_csv, load_completed_tasks
-from utils.progress import print_progress, print_summary
+from utils.data_loader import load_csv_data, sample_data, generation_settings, prompts_outdated, record_prompts, current_sample_id, tag_siblings
+from utils.file_utils import file_exists, save_to_csv, load_prompt_keys, keep_new_prompts
+from utils.progress import print_summary
+from utils.profiling import stage
+from utils.runner import run_api_processing as run_tasks
+from utils.batch_runner import run_batch_processing
+from utils.early_stopping import SequentialStopper
 from services.openrouter import call_api
 from prompts.age_bias import create_age_prompts
 
@@ -33,7 +36,7 @@ Input: {description}"""
 
 
 def clean_all_descriptions(full_data):
-    """Clean all descriptions with progress tracking."""
+    """Clean all descriptions with progress tracking, keyed by freelancer_id."""
     import pickle
     checkpoint_file = config.CLEANING_CHECKPOINT
     
@@ -47,17 +50,24 @@ def clean_all_descriptions(full_data):
         except Exception as e:
             print(f"⚠️ Error loading checkpoint: {e}")
     
+    # Older checkpoints were keyed by row position, which shifts when data files change
+    legacy = [key for key in cleaned_descriptions if not isinstance(key, str)]
+    if legacy:
+        print(f"⚠️ Ignoring {len(legacy)} cleaned descriptions keyed by row position; they will be cleaned again")
+        for key in legacy:
+            del cleaned_descriptions[key]
+    
     # Clean remaining descriptions
-    total_to_clean = len([idx for idx in full_data.index if idx not in cleaned_descriptions])
+    total_to_clean = len([fid for fid in full_data['freelancer_id'] if fid not in cleaned_descriptions])
     if total_to_clean == 0:
         print("✅ All descriptions already cleaned")
         return cleaned_descriptions
     
     print(f"🧹 Cleaning {total_to_clean} descriptions...")
     
-    for idx, row in full_data.iterrows():
-        if idx not in cleaned_descriptions:
-            cleaned_descriptions[idx] = clean_description(row.get('description'))
+    for _, row in full_data.iterrows():
+        if row['freelancer_id'] not in cleaned_descriptions:
+            cleaned_descriptions[row['freelancer_id']] = clean_description(row.get('description'))
             
             # Save checkpoint every 100 descriptions
             if len(cleaned_descriptions) % 100 == 0:
@@ -80,32 +90,43 @@ def clean_all_descriptions(full_data):
 
 
 def generate_age_prompts():
-    """Generate age bias prompts."""
-    if file_exists(config.AGE_PROMPTS_FILE):
-        print(f"✅ {config.AGE_PROMPTS_FILE} exists, skipping generation")
+    """Generate age bias prompts, appending only prompts not generated yet."""
+    settings = generation_settings(ages=config.AGE_VALUES)
+    if file_exists(config.AGE_PROMPTS_FILE) and not prompts_outdated(config.AGE_PROMPTS_FILE, settings):
+        print(f"✅ {config.AGE_PROMPTS_FILE} is up to date, skipping generation")
         return config.AGE_PROMPTS_FILE
     
     print("📝 Generating age bias prompts...")
-    full_data = load_csv_data()
+    full_data = sample_data(load_csv_data())
+    existing = set(load_prompt_keys(config.AGE_PROMPTS_FILE))
     
     # Clean descriptions with checkpointing
     cleaned_descriptions = clean_all_descriptions(full_data)
     
     new_rows = []
+    sample_id = current_sample_id()
     for index, freelancer in full_data.iterrows():
-        cleaned_desc = cleaned_descriptions.get(index, 'Not available')
+        cleaned_desc = cleaned_descriptions.get(freelancer['freelancer_id'], 'Not available')
         for age in config.AGE_VALUES:
-            variations = create_age_prompts(freelancer, age, cleaned_desc)
-            new_rows.extend(variations)
+            with stage('render_prompts'):
+                variations = create_age_prompts(freelancer, age, cleaned_desc)
+            for variation in variations:
+                variation['freelancer_index'] = index
+                variation['sample_id'] = sample_id
+            tag_siblings(variations, freelancer['freelancer_id'])
+            new_rows.extend(keep_new_prompts(variations, existing))
         
         if (index + 1) % 1000 == 0:
             print(f"Processed {index + 1}/{len(full_data)} freelancers")
     
-    save_to_csv(new_rows, config.AGE_PROMPTS_FILE)
+    if new_rows:
+        save_to_csv(new_rows, config.AGE_PROMPTS_FILE, append=True)
+    record_prompts(config.AGE_PROMPTS_FILE, settings)
     
     print_summary("AGE BIAS GENERATION SUMMARY", {
         "Input freelancers": len(full_data),
-        "Output prompts": len(new_rows),
+        "New prompts": len(new_rows),
+        "Total prompts": len(existing),
         "Ages tested": f"{len(config.AGE_VALUES)} ({', '.join(map(str, config.AGE_VALUES))})",
         "Prompt variations": 3
     })
@@ -113,77 +134,24 @@ def generate_age_prompts():
     return config.AGE_PROMPTS_FILE
 
 
-def process_row(row_data, completed_tasks):
-    """Process a single row with all models."""
-    idx, row = row_data
-    results = []
-    
-    for model in config.MODELS:
-        if (idx, model) in completed_tasks:
-            continue
-        
-        result = call_api(row['prompt'], model, idx)
-        if result:
-            result.update({
-                'original_hourly_rate': row['original_hourlyRate'],
-                'age': row['age'],
-                'prompt_variation': row['prompt_variation'],
-                'source_file': row['source_file']
-            })
-            results.append(result)
-    
-    return results
+def result_fields(row) -> dict:
+    """Prompt columns copied onto each result row."""
+    return {
+        'original_hourly_rate': row['original_hourlyRate'],
+        'age': row['age'],
+        'prompt_variation': row['prompt_variation'],
+        'source_file': row['source_file'],
+        'sample_id': row.get('sample_id', 'full'),
+        'prompt_key': row.get('prompt_key'),
+        'freelancer_id': row.get('freelancer_id'),
+        'group_id': row.get('group_id')
+    }
 
 
 def run_api_processing(prompts_file: str):
     """Run API processing with parallel execution."""
-    df = pd.read_csv(prompts_file)
-    completed_tasks = load_completed_tasks(config.AGE_RESULTS_FILE)
-    
-    # Filter unprocessed tasks
-    tasks = []
-    for idx, row in df.iterrows():
-        remaining_models = [m for m in config.MODELS if (idx, m) not in completed_tasks]
-        if remaining_models:
-            tasks.append((idx, row))
-    
-    if not tasks:
-        print("✅ All tasks completed!")
-        return
-    
-    print(f"🚀 Processing {len(tasks)} rows with {len(config.MODELS)} models")
-    
-    success_count = failed_count = 0
-    batch_results = []
-    
-    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
-        future_to_task = {executor.submit(process_row, task, completed_tasks): task[0] for task in tasks}
-        
-        for i, future in enumerate(as_completed(future_to_task)):
-            try:
-                results = future.result(timeout=60)
-                if results:
-                    batch_results.extend(results)
-                    success_count += len([r for r in results if r['status'] == 'success'])
-                    failed_count += len([r for r in results if r['status'] != 'success'])
-                
-                # Save batch periodically
-                if len(batch_results) >= config.BATCH_SIZE:
-                    save_to_csv(batch_results, config.AGE_RESULTS_FILE, append=True)
-                    batch_results = []
-                
-                if (i + 1) % 10 == 0:
-                    print_progress(i + 1, len(tasks), success_count, failed_count)
-                    
-            except Exception as e:
-                print(f"❌ Error: {e}")
-                failed_count += 1
-    
-    # Save remaining results
-    if batch_results:
-        save_to_csv(batch_results, config.AGE_RESULTS_FILE, append=True)
-    
-    print(f"✅ Processing complete! {success_count} success, {failed_count} failed")
+    stopper = SequentialStopper('age', config.AGE_VALUES[0], 'prompt_variation') if config.ADAPTIVE_SAMPLING else None
+    run_tasks(prompts_file, config.AGE_RESULTS_FILE, result_fields, stopper)
 
 
 def main():
@@ -192,6 +160,8 @@ def main():
     print("🚀 Starting Age Bias Pipeline...")
     
     prompts_file = generate_age_prompts()
+    if config.BATCH_MODE:
+        run_batch_processing(prompts_file, config.AGE_RESULTS_FILE, result_fields)
     run_api_processing(prompts_file)
 
 
@@ -1,25 +1,28 @@
-import pandas as pd
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
 import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import config
-from utils.data_loader import load_csv_data
-from utils.file_utils import file_exists, save_to_csv, load_completed_tasks
-from utils.progress import print_progress, print_summary
-from services.openrouter import call_api
+from utils.data_loader import load_csv_data, sample_data, generation_settings, prompts_outdated, record_prompts, current_sample_id, tag_siblings
+from utils.file_utils import file_exists, save_to_csv, load_prompt_keys, keep_new_prompts
+from utils.progress import print_summary
+from utils.profiling import stage
+from utils.runner import run_api_processing as run_tasks
+from utils.batch_runner import run_batch_processing
+from utils.early_stopping import SequentialStopper
 from prompts.gender_bias import create_gender_prompts, load_name_mappings
 
 
 def generate_gender_prompts():
-    """Generate gender bias prompts for all freelancers."""
-    if file_exists(config.GENDER_PROMPTS_FILE):
-        print(f"✅ {config.GENDER_PROMPTS_FILE} exists, skipping generation")
+    """Generate gender bias prompts for all freelancers, appending only prompts not generated yet."""
+    settings = generation_settings()
+    if file_exists(config.GENDER_PROMPTS_FILE) and not prompts_outdated(config.GENDER_PROMPTS_FILE, settings):
+        print(f"✅ {config.GENDER_PROMPTS_FILE} is up to date, skipping generation")
         return config.GENDER_PROMPTS_FILE
     
     print("📝 Generating gender bias prompts...")
-    full_data = load_csv_data()
+    full_data = sample_data(load_csv_data())
+    existing = set(load_prompt_keys(config.GENDER_PROMPTS_FILE))
     name_mapping = load_name_mappings()
     
     if not name_mapping:
@@ -31,20 +34,29 @@ def generate_gender_prompts():
     
     new_rows = []
     processed_count = 0
+    sample_id = current_sample_id()
     
     for index, freelancer in full_data.iterrows():
-        variations = create_gender_prompts(freelancer, name_mapping)
-        new_rows.extend(variations)
+        with stage('render_prompts'):
+            variations = create_gender_prompts(freelancer, name_mapping)
+        for variation in variations:
+            variation['freelancer_index'] = index
+            variation['sample_id'] = sample_id
+        tag_siblings(variations, freelancer['freelancer_id'])
+        new_rows.extend(keep_new_prompts(variations, existing))
         processed_count += 1
         
         if processed_count % 1000 == 0:
             print(f"Processed {processed_count}/{len(full_data)} freelancers")
     
-    save_to_csv(new_rows, config.GENDER_PROMPTS_FILE)
+    if new_rows:
+        save_to_csv(new_rows, config.GENDER_PROMPTS_FILE, append=True)
+    record_prompts(config.GENDER_PROMPTS_FILE, settings)
     
     print_summary("GENDER BIAS GENERATION SUMMARY", {
         "Total freelancers": len(full_data),
-        "Total prompts": len(new_rows),
+        "New prompts": len(new_rows),
+        "Total prompts": len(existing),
         "Gender variations": "3 (male, female, unspecified)",
         "Prompt variations": "4 (base, gender_focused, aggressive_male_favored, aggressive_female_favored)",
         "Prompts per freelancer": "12"
@@ -53,78 +65,25 @@ def generate_gender_prompts():
     return config.GENDER_PROMPTS_FILE
 
 
-def process_row(row_data, completed_tasks):
-    """Process a single row with all models."""
-    idx, row = row_data
-    results = []
-    
-    for model in config.MODELS:
-        if (idx, model) in completed_tasks:
-            continue
-        
-        result = call_api(row['prompt'], model, idx)
-        if result:
-            result.update({
-                'original_hourlyRate': row['original_hourlyRate'],
-                'gender_variation': row['gender_variation'],
-                'injected_name': row['injected_name'],
-                'prompt_variation': row['prompt_variation'],
-                'source_file': row['source_file']
-            })
-            results.append(result)
-    
-    return results
+def result_fields(row) -> dict:
+    """Prompt columns copied onto each result row."""
+    return {
+        'original_hourlyRate': row['original_hourlyRate'],
+        'gender_variation': row['gender_variation'],
+        'injected_name': row['injected_name'],
+        'prompt_variation': row['prompt_variation'],
+        'source_file': row['source_file'],
+        'sample_id': row.get('sample_id', 'full'),
+        'prompt_key': row.get('prompt_key'),
+        'freelancer_id': row.get('freelancer_id'),
+        'group_id': row.get('group_id')
+    }
 
 
 def run_api_processing(prompts_file: str):
     """Run API processing with parallel execution."""
-    df = pd.read_csv(prompts_file)
-    completed_tasks = load_completed_tasks(config.GENDER_RESULTS_FILE)
-    
-    # Filter unprocessed tasks
-    tasks = []
-    for idx, row in df.iterrows():
-        remaining_models = [m for m in config.MODELS if (idx, m) not in completed_tasks]
-        if remaining_models:
-            tasks.append((idx, row))
-    
-    if not tasks:
-        print("✅ All tasks completed!")
-        return
-    
-    print(f"🚀 Processing {len(tasks)} rows with {len(config.MODELS)} models")
-    
-    success_count = failed_count = 0
-    batch_results = []
-    
-    with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
-        future_to_task = {executor.submit(process_row, task, completed_tasks): task[0] for task in tasks}
-        
-        for i, future in enumerate(as_completed(future_to_task)):
-            try:
-                results = future.result(timeout=60)
-                if results:
-                    batch_results.extend(results)
-                    success_count += len([r for r in results if r['status'] == 'success'])
-                    failed_count += len([r for r in results if r['status'] != 'success'])
-                
-                # Save batch periodically
-                if len(batch_results) >= config.BATCH_SIZE:
-                    save_to_csv(batch_results, config.GENDER_RESULTS_FILE, append=True)
-                    batch_results = []
-                
-                if (i + 1) % 10 == 0:
-                    print_progress(i + 1, len(tasks), success_count, failed_count)
-                    
-            except Exception as e:
-                print(f"❌ Error: {e}")
-                failed_count += 1
-    
-    # Save remaining results
-    if batch_results:
-        save_to_csv(batch_results, config.GENDER_RESULTS_FILE, append=True)
-    
-    print(f"✅ Processing complete! {success_count} success, {failed_count} failed")
+    stopper = SequentialStopper('gender_variation', 'unspecified', 'prompt_variation') if config.ADAPTIVE_SAMPLING else None
+    run_tasks(prompts_file, config.GENDER_RESULTS_FILE, result_fields, stopper)
 
 
 def main():
@@ -134,6 +93,8 @@ def main():
     
     prompts_file = generate_gender_prompts()
     if prompts_file:
+        if config.BATCH_MODE:
+            run_batch_processing(prompts_file, config.GENDER_RESULTS_FILE, result_fields)
         run_api_processing(prompts_file)
 
 
@@ -0,0 +1,102 @@
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from utils.data_loader import load_csv_data, sample_data, generation_settings, prompts_outdated, record_prompts, current_sample_id, tag_siblings
+from utils.file_utils import file_exists, save_to_csv, load_prompt_keys, keep_new_prompts
+from utils.progress import print_summary
+from utils.profiling import stage
+from utils.runner import run_api_processing as run_tasks
+from utils.batch_runner import run_batch_processing
+from prompts.counterfactual import CounterfactualSpace
+from prompts.gender_bias import load_name_mappings
+from pipelines.age_pipeline import clean_all_descriptions
+
+
+def generate_interaction_prompts():
+    """Generate cross-axis counterfactual prompts not generated yet, streaming them to disk."""
+    settings = generation_settings(
+        axes=config.INTERACTION_AXES, max_order=config.INTERACTION_MAX_ORDER,
+        ages=config.AGE_VALUES, countries=config.LOCATION_COUNTRIES,
+        descriptions='cleaned' if 'age' in config.INTERACTION_AXES else 'original'
+    )
+    if file_exists(config.INTERACTION_PROMPTS_FILE) and not prompts_outdated(config.INTERACTION_PROMPTS_FILE, settings):
+        print(f"✅ {config.INTERACTION_PROMPTS_FILE} is up to date, skipping generation")
+        return config.INTERACTION_PROMPTS_FILE
+
+    print("📝 Generating interaction prompts...")
+    full_data = sample_data(load_csv_data())
+    existing = set(load_prompt_keys(config.INTERACTION_PROMPTS_FILE))
+    name_mapping = load_name_mappings()
+    if 'age' in config.INTERACTION_AXES:
+        # Age cells start from the same cleaned descriptions as the age study
+        cleaned_descriptions = clean_all_descriptions(full_data)
+        full_data = full_data.assign(cleaned_description=full_data['freelancer_id'].map(cleaned_descriptions))
+    space = CounterfactualSpace(full_data, config.INTERACTION_AXES, name_mapping, config.INTERACTION_MAX_ORDER)
+
+    print(f"👥 Processing {len(full_data)} freelancers x {len(space.cells)} cells")
+
+    sample_id = current_sample_id()
+    new_rows = []
+    written = 0
+    with stage('render_prompts'):
+        for variation in space:
+            variation['sample_id'] = sample_id
+            tag_siblings([variation], variation['freelancer_id'])
+            new_rows.extend(keep_new_prompts([variation], existing))
+
+            if len(new_rows) >= config.BATCH_SIZE * 10:
+                save_to_csv(new_rows, config.INTERACTION_PROMPTS_FILE, append=True)
+                written += len(new_rows)
+                new_rows = []
+
+    if new_rows:
+        save_to_csv(new_rows, config.INTERACTION_PROMPTS_FILE, append=True)
+        written += len(new_rows)
+    record_prompts(config.INTERACTION_PROMPTS_FILE, settings)
+
+    print_summary("INTERACTION GENERATION SUMMARY", {
+        "Input freelancers": len(full_data),
+        "Axes": ', '.join(config.INTERACTION_AXES),
+        "Design": f"max order {config.INTERACTION_MAX_ORDER}" if config.INTERACTION_MAX_ORDER else "full factorial",
+        "Cells per freelancer": len(space.cells),
+        "New prompts": written,
+        "Total prompts": len(existing)
+    })
+
+    return config.INTERACTION_PROMPTS_FILE
+
+
+def result_fields(row) -> dict:
+    """Prompt columns copied onto each result row."""
+    return {
+        'original_hourlyRate': row['original_hourlyRate'],
+        **{f'{axis}_variation': row[f'{axis}_variation'] for axis in config.INTERACTION_AXES},
+        'injected_name': row['injected_name'],
+        'source_file': row['source_file'],
+        'sample_id': row.get('sample_id', 'full'),
+        'prompt_key': row.get('prompt_key'),
+        'freelancer_id': row.get('freelancer_id'),
+        'group_id': row.get('group_id')
+    }
+
+
+def run_api_processing(prompts_file: str):
+    """Run API processing with parallel execution."""
+    run_tasks(prompts_file, config.INTERACTION_RESULTS_FILE, result_fields)
+
+
+def main():
+    """Main interaction pipeline."""
+    config.validate_config()
+    print("🚀 Starting Interaction Pipeline...")
+
+    prompts_file = generate_interaction_prompts()
+    if config.BATCH_MODE:
+        run_batch_processing(prompts_file, config.INTERACTION_RESULTS_FILE, result_fields)
+    run_api_processing(prompts_file)
+
+
+if __name__ == "__main__":
+    main()
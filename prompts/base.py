@@ -23,6 +23,12 @@ def create_base_prompt(tasks: str, description: str, location: str) -> str:
 {JSON_OUTPUT_FORMAT}"""
 
 
+def introduce(description: str, *sentences: str) -> str:
+    """Prepend a "Hi! ..." self-introduction to a profile description."""
+    greeting = "Hi! " + " ".join(sentences)
+    return greeting if description == 'Not available' else f"{greeting} {description}"
+
+
 def construct_prompt(profile: dict) -> str:
     """Construct the rate determination prompt for a given profile."""
     # Get the tasks/services from title
@@ -0,0 +1,123 @@
+"""Cross-product counterfactual prompt generation over age, gender and location axes."""
+from itertools import product
+
+import pandas as pd
+from .base import create_base_prompt, introduce
+from .age_bias import age_intro, usable_description
+from .gender_bias import name_intro, pick_name
+import config
+
+# Axis values; the first value of each axis is its baseline
+AXES = {
+    'age': ['unspecified'] + list(config.AGE_VALUES),
+    'gender': ['unspecified', 'male', 'female'],
+    'location': ['Unspecified location'] + [c for c in config.LOCATION_COUNTRIES if c != 'Unspecified location'],
+}
+
+
+def design_cells(axes: list, max_order: int = None) -> list:
+    """List the cells of a (partial) factorial design over the given axes.
+
+    A cell is a tuple with one value per axis. With ``max_order`` set, only cells
+    that differ from the all-baseline cell on at most ``max_order`` axes are kept,
+    e.g. 1 gives baseline plus main effects, 2 adds two-way interactions.
+    """
+    unknown = [axis for axis in axes if axis not in AXES]
+    if unknown:
+        raise ValueError(f"Unknown counterfactual axes: {unknown}")
+
+    cells = []
+    for cell in product(*(AXES[axis] for axis in axes)):
+        order = sum(value != AXES[axis][0] for axis, value in zip(axes, cell))
+        if max_order is None or order <= max_order:
+            cells.append(cell)
+    return cells
+
+
+class CounterfactualSpace:
+    """Lazily enumerated freelancer x design-cell variant space.
+
+    Variant ``k`` is freelancer ``k // len(cells)`` rendered for cell
+    ``k % len(cells)``, so any variant can be rendered on demand without
+    materializing the rest.
+    """
+
+    def __init__(self, freelancers: pd.DataFrame, axes: list, name_mapping: dict, max_order: int = None):
+        self.freelancers = freelancers
+        self.axes = list(axes)
+        self.name_mapping = name_mapping
+        self.cells = design_cells(self.axes, max_order)
+
+    def __len__(self):
+        return len(self.freelancers) * len(self.cells)
+
+    def __getitem__(self, k: int) -> dict:
+        if not 0 <= k < len(self):
+            raise IndexError(f"Variant {k} out of range for {len(self)} variants")
+        position, cell_index = divmod(k, len(self.cells))
+        freelancer_index = self.freelancers.index[position]
+        return self.render(self.freelancers.iloc[position], freelancer_index, cell_index)
+
+    def __iter__(self):
+        for freelancer_index, freelancer in self.freelancers.iterrows():
+            for cell_index in range(len(self.cells)):
+                yield self.render(freelancer, freelancer_index, cell_index)
+
+    def render(self, freelancer, freelancer_index, cell_index: int) -> dict:
+        """Render the prompt for one freelancer and one design cell."""
+        assignment = dict(zip(self.axes, self.cells[cell_index]))
+        return {
+            'freelancer_index': freelancer_index,
+            'freelancer_id': freelancer.get('freelancer_id'),
+            'cell_index': cell_index,
+            **{f'{axis}_variation': value for axis, value in assignment.items()},
+            **create_counterfactual_prompt(freelancer, assignment, self.name_mapping)
+        }
+
+
+def create_counterfactual_prompt(freelancer: dict, assignment: dict, name_mapping: dict) -> dict:
+    """Create one prompt with the given age, gender and location values applied.
+
+    Each factor is applied with its own study's rewrite: the age and name
+    sentences come from the age and gender builders (the name follows the
+    counterfactual country), and the location replaces the location line as
+    in the location study. Designs with an age axis start from the age study's cleaned
+    description (``cleaned_description``) in every cell, so no cell keeps age
+    or experience cues that contradict the injected age.
+    """
+
+    def safe_get(key, default='Not available'):
+        value = freelancer.get(key, default)
+        return default if pd.isna(value) else value
+
+    tasks = safe_get('title', safe_get('skills'))
+    if 'age' in assignment:
+        description = usable_description(freelancer.get('cleaned_description'))
+    else:
+        description = safe_get('description')
+    country = safe_get('country', 'Not specified')
+    location = f"{safe_get('locality', 'Not specified')}, {country}"
+
+    if 'location' in assignment:
+        location = assignment['location']
+        if location != 'Unspecified location':
+            country = location
+
+    intro = []
+    injected_name = None
+    if assignment.get('gender', 'unspecified') != 'unspecified':
+        injected_name = pick_name(name_mapping, country, assignment['gender'])
+        intro.append(name_intro(injected_name))
+    if assignment.get('age', 'unspecified') != 'unspecified':
+        intro.append(age_intro(assignment['age']))
+
+    modified_description = introduce(description, *intro) if intro else description
+
+    return {
+        'original_hourlyRate': safe_get('hourlyRate'),
+        'original_country': safe_get('country', 'Not specified'),
+        'source_file': safe_get('source_file', 'Unknown'),
+        'injected_name': injected_name,
+        'modified_description': modified_description,
+        'prompt': create_base_prompt(tasks, modified_description, location)
+    }
@@ -0,0 +1,236 @@
+"""Local HTTP service auditing one profile's rate recommendations across counterfactual variants."""
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+from prompts.age_bias import create_age_prompts
+from prompts.base import construct_prompt
+from prompts.gender_bias import create_gender_prompts, load_name_mappings
+from prompts.location_bias import create_location_prompts
+from services.openrouter import ModelUnavailable, chat_request, guarded_request, parse_response
+from utils.file_utils import prompt_key
+
+# (model, prompt key) -> (expiry time, outcome); in-flight calls shared by concurrent audits
+_cache = OrderedDict()
+_inflight = {}
+_lock = threading.Lock()
+_stats = {'audits': 0, 'calls': 0, 'cache_hits': 0, 'coalesced': 0, 'pending': 0}
+_executor = None
+_name_mapping = None
+
+
+def build_variants(profile: dict, axes: list, variations) -> list:
+    """Baseline prompt plus the age, gender and location variants of one profile.
+
+    ``variations`` limits the prompt variations per axis (e.g. ['base']); 'all'
+    keeps every variation the study builders produce.
+    """
+    global _name_mapping
+    variants = [{'axis': 'baseline', 'value': None, 'prompt_variation': 'base', 'prompt': construct_prompt(profile)}]
+
+    if 'age' in axes:
+        for age in config.AGE_VALUES:
+            for row in create_age_prompts(profile, age, profile.get('description')):
+                variants.append({'axis': 'age', 'value': age, 'prompt_variation': row['prompt_variation'], 'prompt': row['prompt']})
+    if 'gender' in axes:
+        if _name_mapping is None:
+            _name_mapping = load_name_mappings()
+        for row in create_gender_prompts(profile, _name_mapping):
+            variants.append({'axis': 'gender', 'value': row['gender_variation'], 'prompt_variation': row['prompt_variation'], 'prompt': row['prompt']})
+    if 'location' in axes:
+        freelancer = {'hourlyRate': None, 'country': 'Not specified', 'source_file': 'audit', **profile}
+        for country in config.LOCATION_COUNTRIES:
+            for row in create_location_prompts(freelancer, country):
+                variants.append({'axis': 'location', 'value': country, 'prompt_variation': row['version'], 'prompt': row['prompt']})
+
+    if variations == 'all':
+        return variants
+    return [v for v in variants if v['axis'] == 'baseline' or v['prompt_variation'] in variations]
+
+
+def fetch(prompt: str, model: str, key: tuple) -> dict:
+    """Query a model once and cache the outcome if it succeeded."""
+    try:
+        result, status = guarded_request(chat_request(prompt, model), model)
+    except ModelUnavailable:
+        result, status = None, 'model_unavailable'
+    except Exception as e:
+        result, status = None, f'error_{e}'
+
+    content = result['choices'][0]['message']['content'] if result else None
+    rate, reasoning = parse_response(content) if content is not None else (None, None)
+    outcome = {'recommended_rate': rate, 'reasoning': reasoning, 'status': status}
+
+    with _lock:
+        _inflight.pop(key, None)
+        if status == 'success':
+            _cache[key] = (time.time() + config.AUDIT_CACHE_TTL, outcome)
+            _cache.move_to_end(key)
+            while len(_cache) > config.AUDIT_CACHE_SIZE:
+                _cache.popitem(last=False)
+    return outcome
+
+
+def submit(prompt: str, model: str) -> tuple[Future, str]:
+    """Future for a (prompt, model) outcome and where it came from: cache, coalesced or call.
+
+    Identical calls from concurrent audits share one in-flight request.
+    """
+    global _executor
+    key = (model, prompt_key(prompt))
+    with _lock:
+        cached = _cache.get(key)
+        if cached and cached[0] > time.time():
+            _cache.move_to_end(key)
+            _stats['cache_hits'] += 1
+            future = Future()
+            future.set_result(cached[1])
+            return future, 'cache'
+        if key in _inflight:
+            _stats['coalesced'] += 1
+            return _inflight[key], 'coalesced'
+
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=config.AUDIT_WORKERS)
+        _stats['calls'] += 1
+        future = _inflight[key] = _executor.submit(fetch, prompt, model, key)
+        return future, 'call'
+
+
+def mean(values: list):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+def bias_deltas(rows: list) -> dict:
+    """Per-axis mean rate of each counterfactual value minus the model's baseline rate."""
+    baseline = mean([r['recommended_rate'] for r in rows if r['axis'] == 'baseline'])
+    deltas = {}
+    for axis in dict.fromkeys(r['axis'] for r in rows if r['axis'] != 'baseline'):
+        values = {}
+        for row in rows:
+            if row['axis'] == axis:
+                values.setdefault(str(row['value']), []).append(row['recommended_rate'])
+        rates = {value: mean(found) for value, found in values.items()}
+        known = [rate for rate in rates.values() if rate is not None]
+        deltas[axis] = {
+            'delta_vs_baseline': {value: None if rate is None or baseline is None else round(rate - baseline, 2)
+                                  for value, rate in rates.items()},
+            'spread': round(max(known) - min(known), 2) if known else None
+        }
+    return {'baseline_rate': baseline, 'axes': deltas}
+
+
+def validate_request(request) -> dict:
+    """Check an audit request body, raising ValueError with the reason when it is unusable."""
+    if not isinstance(request, dict):
+        raise ValueError("request body must be a JSON object")
+    if not isinstance(request.get('profile'), dict):
+        raise ValueError("request needs a 'profile' object")
+    if 'budget' in request:
+        budget = request['budget']
+        if isinstance(budget, bool) or not isinstance(budget, (int, float)) or not budget >= 0:
+            raise ValueError("'budget' must be a non-negative number of seconds")
+    for key in ('models', 'axes'):
+        value = request.get(key)
+        if value is not None and (not isinstance(value, list) or not all(isinstance(v, str) for v in value)):
+            raise ValueError(f"'{key}' must be a list of strings")
+    unknown = set(request.get('axes') or []) - {'age', 'gender', 'location'}
+    if unknown:
+        raise ValueError(f"unknown axes: {sorted(unknown)}")
+    variations = request.get('variations')
+    if variations is not None and variations != 'all' and (
+            not isinstance(variations, list) or not all(isinstance(v, str) for v in variations)):
+        raise ValueError("'variations' must be 'all' or a list of strings")
+    return request
+
+
+def audit(request: dict) -> dict:
+    """Run one audit: fan the profile's variants out across models within the latency budget.
+
+    Calls still running when the budget runs out are reported as ``pending``;
+    they keep running and land in the cache for the next audit of the profile.
+    """
+    started = time.perf_counter()
+    profile = request['profile']
+    models = request.get('models') or config.MODELS
+    budget = min(float(request.get('budget', config.AUDIT_BUDGET_SECONDS)), config.AUDIT_BUDGET_SECONDS)
+    variants = build_variants(profile, request.get('axes') or config.AUDIT_AXES,
+                              request.get('variations') or config.AUDIT_VARIATIONS)
+
+    calls = [(variant, model, *submit(variant['prompt'], model)) for model in models for variant in variants]
+    wait([future for _, _, future, _ in calls], timeout=max(budget - (time.perf_counter() - started), 0))
+
+    results = {model: [] for model in models}
+    for variant, model, future, source in calls:
+        outcome = future.result() if future.done() else {'recommended_rate': None, 'reasoning': None, 'status': 'pending'}
+        row = {key: value for key, value in variant.items() if key != 'prompt'}
+        row.update(outcome, source=source)
+        results[model].append(row)
+
+    pending = sum(row['status'] == 'pending' for rows in results.values() for row in rows)
+    with _lock:
+        _stats['audits'] += 1
+        _stats['pending'] += pending
+    return {
+        'complete': not pending,
+        'pending': pending,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'models': {model: {'variants': rows, **bias_deltas(rows)} for model, rows in results.items()}
+    }
+
+
+def service_stats() -> dict:
+    with _lock:
+        return {**_stats, 'cached': len(_cache), 'in_flight': len(_inflight)}
+
+
+class AuditHandler(BaseHTTPRequestHandler):
+    """POST /audit with {"profile": {...}}; GET /stats for cache and coalescing counters."""
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json(200, service_stats())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/audit':
+            self.send_json(404, {'error': 'not found'})
+            return
+        try:
+            request = validate_request(json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0)))))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(200, audit(request))
+
+    def log_message(self, format, *args):
+        if config.AUDIT_LOG_REQUESTS:
+            super().log_message(format, *args)
+
+
+def serve(host: str = None, port: int = None):
+    """Serve audits until interrupted."""
+    server = ThreadingHTTPServer((host or config.AUDIT_HOST, port or config.AUDIT_PORT), AuditHandler)
+    print(f"🔎 Audit service on http://{server.server_address[0]}:{server.server_address[1]}/audit "
+          f"({len(config.MODELS)} models, {config.AUDIT_BUDGET_SECONDS}s budget)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"🛑 Audit service stopped: {service_stats()}")
@@ -0,0 +1,103 @@
+"""OpenAI-compatible batch API client (/files and /batches endpoints)."""
+import json
+import requests
+
+import config
+from services.openrouter import chat_request, build_result
+
+TERMINAL_STATUSES = {'completed', 'failed', 'expired', 'cancelled'}
+
+
+def create_batch_session():
+    """Create a requests session for the batch provider."""
+    session = requests.Session()
+    session.headers.update({"Authorization": f"Bearer {config.BATCH_API_KEY}"})
+    return session
+
+
+def task_id(row_index: int, model: str, first_sample: int = 0) -> str:
+    """Encode a (row_index, model) task and its first sample index as a batch custom_id."""
+    return f"{row_index}|{model}|{first_sample}"
+
+
+def parse_task_id(custom_id: str) -> tuple[int, str, int]:
+    """Decode a batch custom_id back into (row_index, model, first_sample)."""
+    row_index, model, *first_sample = custom_id.split('|')
+    return int(row_index), model, int(first_sample[0]) if first_sample else 0
+
+
+def batch_line(prompt: str, model: str, row_index: int, samples: int = 1, first_sample: int = 0) -> str:
+    """Build one JSONL request line, mapping the model to the batch provider's ID."""
+    body = chat_request(prompt, config.BATCH_MODELS[model])
+    if samples > 1:
+        body['n'] = samples
+    return json.dumps({
+        "custom_id": task_id(row_index, model, first_sample),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": body
+    })
+
+
+def upload_file(session, path: str) -> str:
+    """Upload a JSONL batch input file and return its file ID."""
+    with open(path, 'rb') as f:
+        response = session.post(
+            f"{config.BATCH_API_BASE}/files",
+            files={"file": (path.split('/')[-1], f, "application/jsonl")},
+            data={"purpose": "batch"},
+            timeout=config.API_TIMEOUT * 10
+        )
+    response.raise_for_status()
+    return response.json()['id']
+
+
+def create_batch(session, file_id: str) -> dict:
+    """Create a batch job for an uploaded input file."""
+    response = session.post(
+        f"{config.BATCH_API_BASE}/batches",
+        json={"input_file_id": file_id, "endpoint": "/v1/chat/completions", "completion_window": "24h"},
+        timeout=config.API_TIMEOUT
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def retrieve_batch(session, batch_id: str) -> dict:
+    """Fetch the current state of a batch job."""
+    response = session.get(f"{config.BATCH_API_BASE}/batches/{batch_id}", timeout=config.API_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def download_file(session, file_id: str) -> str:
+    """Download the content of an output or error file."""
+    response = session.get(f"{config.BATCH_API_BASE}/files/{file_id}/content", timeout=config.API_TIMEOUT * 10)
+    response.raise_for_status()
+    return response.text
+
+
+def parse_output_line(line: str) -> list:
+    """Map one batch output line onto call_api result rows, one per returned sample.
+    
+    Returns an empty list for retryable failures (429, 5xx, missing response)
+    so the task is resubmitted in a later batch.
+    """
+    record = json.loads(line)
+    row_index, model, first_sample = parse_task_id(record['custom_id'])
+    response = record.get('response') or {}
+    status_code = response.get('status_code')
+    
+    if status_code == 200:
+        choices = response['body']['choices']
+        results = [build_result(row_index, model, choice['message']['content'], 'success', raw=response['body'], choice=i)
+                   for i, choice in enumerate(choices)]
+    elif status_code is None or status_code == 429 or status_code >= 500:
+        return []
+    else:
+        samples = max(config.SAMPLES_PER_TASK - first_sample, 1)
+        results = [build_result(row_index, model, None, f'error_{status_code}') for _ in range(samples)]
+    
+    for offset, result in enumerate(results):
+        result['sample_index'] = first_sample + offset
+    return results
@@ -0,0 +1,152 @@
+"""In-process stand-in for an OpenAI-compatible batch API (/files and /batches).
+
+Point BATCH_API_BASE at ``BatchStub().start()`` to run batch mode without a
+provider. Batches finish after ``polls`` retrievals, and every request line
+is answered by ``respond(custom_id, body)``, which returns (status code, body).
+"""
+import email
+import itertools
+import json
+import threading
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETION = json.dumps({"recommended_hourly_rate_usd": 40, "reasoning": "Stub batch answer"})
+
+
+def answer(custom_id: str, body: dict) -> tuple[int, dict]:
+    """Default response: one completion per requested sample."""
+    choices = [{"index": i, "message": {"role": "assistant", "content": COMPLETION}} for i in range(body.get('n', 1))]
+    return 200, {"id": f"chatcmpl-{custom_id}", "model": body.get('model'), "choices": choices}
+
+
+class BatchStub:
+    """Batch provider serving uploaded files and batch jobs from memory."""
+
+    def __init__(self, respond=answer, polls: int = 1, host: str = "127.0.0.1", port: int = 0):
+        self.respond = respond
+        self.polls = polls
+        self.files = {}
+        self.batches = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def new_id(self, prefix: str) -> str:
+        return f"{prefix}-{next(self.ids)}"
+
+    def upload(self, content_type: str, body: bytes) -> dict:
+        message = email.message_from_bytes(f"Content-Type: {content_type}\r\n\r\n".encode() + body, policy=HTTP)
+        part = next(p for p in message.iter_parts() if p.get_param('name', header='content-disposition') == 'file')
+        with self.lock:
+            file_id = self.new_id('file')
+            self.files[file_id] = part.get_payload(decode=True).decode()
+        return {"id": file_id, "object": "file", "purpose": "batch"}
+
+    def create(self, request: dict) -> dict:
+        with self.lock:
+            if request.get('input_file_id') not in self.files:
+                return None
+            batch_id = self.new_id('batch')
+            self.batches[batch_id] = {"id": batch_id, "object": "batch", "status": "in_progress",
+                                      "input_file_id": request['input_file_id'], "polls": 0}
+            return self.public(self.batches[batch_id])
+
+    def retrieve(self, batch_id: str) -> dict:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            batch['polls'] += 1
+            if batch['status'] == 'in_progress' and batch['polls'] >= self.polls:
+                self.finish(batch)
+            return self.public(batch)
+
+    def finish(self, batch: dict):
+        """Answer every request line of a batch and store the output file."""
+        lines = []
+        for line in self.files[batch['input_file_id']].splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            status_code, body = self.respond(request['custom_id'], request['body'])
+            lines.append(json.dumps({"id": self.new_id('response'), "custom_id": request['custom_id'],
+                                     "response": {"status_code": status_code, "body": body}}))
+        output_id = self.new_id('file')
+        self.files[output_id] = '\n'.join(lines) + '\n'
+        batch.update(status='completed', output_file_id=output_id)
+
+    @staticmethod
+    def public(batch: dict) -> dict:
+        return {key: value for key, value in batch.items() if key != 'polls'}
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def send_json(self, status: int, body):
+                data = (body if isinstance(body, str) else json.dumps(body)).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path == '/v1/files':
+                    self.send_json(200, stub.upload(self.headers['Content-Type'], body))
+                elif self.path == '/v1/batches':
+                    job = stub.create(json.loads(body))
+                    if job:
+                        self.send_json(200, job)
+                    else:
+                        self.send_json(400, {"error": "unknown input_file_id"})
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def do_GET(self):
+                parts = self.path.strip('/').split('/')
+                if parts[:2] == ['v1', 'batches'] and len(parts) == 3:
+                    job = stub.retrieve(parts[2])
+                    if job:
+                        self.send_json(200, job)
+                    else:
+                        self.send_json(404, {"error": "unknown batch"})
+                elif parts[:2] == ['v1', 'files'] and len(parts) == 4 and parts[3] == 'content':
+                    content = stub.files.get(parts[2])
+                    if content is not None:
+                        self.send_json(200, content)
+                    else:
+                        self.send_json(404, {"error": "unknown file"})
+                else:
+                    self.send_json(404, {"error": "not found"})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == "__main__":
+    stub = BatchStub(port=8790)
+    print(f"🧪 Batch stub on {stub.url} (set BATCH_API_BASE to this URL)")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        stub.server.server_close()
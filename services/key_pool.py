@@ -0,0 +1,206 @@
+"""Pool of OpenRouter API keys with per-key quota, rate-limit and failure tracking."""
+import os
+import threading
+import time
+from typing import Optional
+
+import requests
+
+import config
+
+KEY_ERROR_CODES = (401, 402, 403, 429)  # Rejections that another key may not get
+
+
+def load_keys() -> list:
+    """Keys from OPENROUTER_API_KEYS, OPENROUTER_KEYS_FILE and OPENROUTER_API_KEY, without duplicates."""
+    keys = list(config.OPENROUTER_API_KEYS)
+    if config.OPENROUTER_KEYS_FILE and os.path.exists(config.OPENROUTER_KEYS_FILE):
+        with open(config.OPENROUTER_KEYS_FILE) as f:
+            keys.extend(line.strip() for line in f if line.strip() and not line.strip().startswith('#'))
+    if config.OPENROUTER_API_KEY:
+        keys.append(config.OPENROUTER_API_KEY)
+    return list(dict.fromkeys(keys))
+
+
+class ApiKey:
+    """One key's usage counters and availability."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.label = f"...{key[-6:]}"
+        self.in_flight = 0
+        self.requests = 0
+        self.successes = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+        self.cost = 0.0
+        self.remaining = None  # USD left per OpenRouter, None while unknown or unlimited
+        self.spent_since_refresh = 0.0
+        self.refreshed_at = 0.0
+        self.refreshing = False
+        self.cooldown = config.KEY_COOLDOWN
+        self.quarantined_until = 0.0
+        self.exhausted = False  # Out of credit until a refresh shows otherwise
+        self.disabled = None  # Reason the key is out for the rest of the run
+
+    def headroom(self) -> Optional[float]:
+        """Estimated USD left: the last reported credit minus what was spent since."""
+        return None if self.remaining is None else self.remaining - self.spent_since_refresh
+
+    def state(self, now: float) -> str:
+        if self.disabled:
+            return self.disabled
+        if self.exhausted and self.quarantined_until > now:
+            return "out of credit"
+        if self.quarantined_until > now:
+            return f"quarantined {self.quarantined_until - now:.0f}s"
+        return "active"
+
+
+class KeyPool:
+    """Spreads requests over API keys in proportion to their remaining credit.
+
+    A key is quarantined for KEY_COOLDOWN seconds (doubling, up to
+    KEY_MAX_COOLDOWN) after a 429 or KEY_FAILURE_LIMIT errors in a row, set
+    aside until its next credit refresh when it runs out (402 or less than
+    KEY_MIN_REMAINING left), and dropped for the run when rejected (401/403).
+    When no key is available the one leaving quarantine first is used, so
+    callers fall back to the regular retry backoff instead of blocking.
+    Credit is re-read on a background thread, so acquire() never waits on it.
+    """
+
+    def __init__(self, keys: list, info_url: str):
+        if not keys:
+            raise ValueError("KeyPool needs at least one API key: set OPENROUTER_API_KEY, OPENROUTER_API_KEYS or list keys in OPENROUTER_KEYS_FILE")
+        self.keys = [ApiKey(key) for key in keys]
+        self.info_url = info_url
+        self.lock = threading.Lock()
+        self.refresher = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    def usable(self, now: float) -> list:
+        return [k for k in self.keys if not k.disabled and k.quarantined_until <= now]
+
+    def acquire(self) -> ApiKey:
+        """Pick a key so that requests are spread in proportion to each key's estimated credit."""
+        self.refresh_due()
+        with self.lock:
+            now = time.time()
+            candidates = self.usable(now)
+            if not candidates:
+                candidates = sorted((k for k in self.keys if not k.disabled), key=lambda k: k.quarantined_until)[:1] or self.keys[:1]
+            known = [k.headroom() for k in candidates if k.headroom() is not None]
+            default = max(known) if known else 1.0
+            best = min(candidates, key=lambda k: (k.requests + 1) / max(k.headroom() if k.headroom() is not None else default, 1e-9))
+            best.in_flight += 1
+            best.requests += 1
+            return best
+
+    def has_alternative(self, api_key: ApiKey) -> bool:
+        """Check whether a key other than this one is available now."""
+        with self.lock:
+            return any(k is not api_key for k in self.usable(time.time()))
+
+    def _quarantine(self, api_key: ApiKey, seconds: float):
+        api_key.quarantined_until = time.time() + seconds
+        api_key.cooldown = min(api_key.cooldown * 2, config.KEY_MAX_COOLDOWN)
+
+    def release(self, api_key: ApiKey, status_code: Optional[int]):
+        """Record the outcome of a request made with a key (None for connection errors and timeouts)."""
+        with self.lock:
+            api_key.in_flight -= 1
+            if status_code == 200:
+                api_key.successes += 1
+                api_key.consecutive_errors = 0
+                api_key.cooldown = config.KEY_COOLDOWN
+            elif status_code == 429:
+                api_key.rate_limited += 1
+                self._quarantine(api_key, api_key.cooldown)
+            elif status_code == 402:
+                api_key.errors += 1
+                api_key.exhausted = True
+                self._quarantine(api_key, config.KEY_REFRESH_SECONDS or config.KEY_MAX_COOLDOWN)
+            elif status_code in (401, 403):
+                api_key.errors += 1
+                api_key.disabled = f"rejected ({status_code})"
+            elif status_code is None or status_code >= 500:
+                api_key.errors += 1
+                api_key.consecutive_errors += 1
+                if api_key.consecutive_errors >= config.KEY_FAILURE_LIMIT:
+                    api_key.consecutive_errors = 0
+                    self._quarantine(api_key, api_key.cooldown)
+
+    def cancel(self, api_key: ApiKey):
+        """Return a key acquired for a request that was never sent."""
+        with self.lock:
+            api_key.in_flight -= 1
+            api_key.requests -= 1
+
+    def record_cost(self, api_key: Optional[ApiKey], usage: Optional[dict]):
+        """Add the cost OpenRouter reported for a response to the key's spend."""
+        cost = (usage or {}).get('cost')
+        if api_key is None or not isinstance(cost, (int, float)):
+            return
+        with self.lock:
+            api_key.cost += cost
+            api_key.spent_since_refresh += cost
+
+    def refresh_due(self):
+        """Start a background refresh of keys not checked for KEY_REFRESH_SECONDS, if none is running."""
+        if not config.KEY_REFRESH_SECONDS:
+            return
+        now = time.time()
+        with self.lock:
+            if self.refresher is not None and self.refresher.is_alive():
+                return
+            due = [k for k in self.keys if not k.disabled and not k.refreshing
+                   and k.refreshed_at + config.KEY_REFRESH_SECONDS <= now]
+            if not due:
+                return
+            for api_key in due:
+                api_key.refreshing = True
+            self.refresher = threading.Thread(target=self.refresh_all, args=(due,), daemon=True)
+            self.refresher.start()
+
+    def refresh_all(self, keys: list):
+        for api_key in keys:
+            self.refresh(api_key)
+
+    def refresh(self, api_key: ApiKey):
+        """Read a key's remaining credit from OpenRouter; failures leave the estimate unchanged."""
+        fetched = False
+        try:
+            response = requests.get(self.info_url, headers={"Authorization": f"Bearer {api_key.key}"}, timeout=5)
+            if response.status_code == 200:
+                remaining = response.json().get('data', {}).get('limit_remaining')
+                fetched = True
+        except (requests.RequestException, ValueError, AttributeError):
+            pass
+
+        with self.lock:
+            api_key.refreshed_at = time.time()
+            api_key.refreshing = False
+            if not fetched:
+                return
+            api_key.remaining = remaining
+            api_key.spent_since_refresh = 0.0
+            if remaining is not None and remaining < config.KEY_MIN_REMAINING:
+                api_key.exhausted = True
+                api_key.quarantined_until = api_key.refreshed_at + config.KEY_REFRESH_SECONDS
+            elif api_key.exhausted and remaining is not None:
+                api_key.exhausted = False
+                api_key.quarantined_until = 0.0
+
+    def summary(self) -> dict:
+        """Per-key usage for the run summary."""
+        now = time.time()
+        with self.lock:
+            rows = {}
+            for k in self.keys:
+                left = f", ${k.headroom():.2f} left" if k.headroom() is not None else ""
+                rows[f"Key {k.label}"] = (f"{k.requests:,} requests, {k.successes:,} ok, {k.rate_limited:,} x 429, "
+                                          f"{k.errors:,} errors, ${k.cost:.4f} spent{left}, {k.state(now)}")
+            return rows
@@ -3,17 +3,164 @@ import time
 import random
 import threading
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
 from typing import Optional, Dict, Any
 import re
 
 import config
+from services.key_pool import KEY_ERROR_CODES, KeyPool, load_keys
+from utils.profiling import stage
+
+API_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+# Per-model latency history and hedging counters, shared across worker threads
+_latencies = {}
+_hedge_stats = {'calls': 0, 'hedges': 0, 'hedge_wins': 0}
+_hedge_lock = threading.Lock()
+_hedge_executor = None
+_repeat_executor = None
+
+# Per-model count of samples an ``n`` request came back short of, topped up with single calls
+_n_shortfalls = {}
+
+# Per-model circuit breakers
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# API key pool, created on first request
+_key_pool = None
+
+
+class ModelUnavailable(Exception):
+    """Raised when a model's circuit breaker is open and the task should be parked."""
+
+
+def failure_class(status: str) -> str:
+    """Classify a result status as 'success', 'transient' (worth retrying later) or 'permanent'."""
+    if status == 'success':
+        return 'success'
+    if status in ('max_retries_exceeded', 'malformed_response'):
+        # Exhausted 5xx/429/timeout retries within the call, or a 200 without usable completions
+        return 'transient'
+    if not status.startswith('error_'):
+        return 'permanent'
+    code = status[6:]
+    if not code.isdigit():
+        # Connection-level exception
+        return 'transient'
+    return 'transient' if int(code) >= 500 or int(code) in config.RETRY_TRANSIENT_CODES else 'permanent'
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker for one model.
+    
+    Opens immediately on fatal statuses (e.g. 404 for a removed model, 403 for
+    lost access) or once the error rate over the last BREAKER_WINDOW calls
+    reaches BREAKER_ERROR_RATE. After a cooldown a single probe is let through
+    (half-open); success closes the breaker, failure reopens it with a longer
+    cooldown.
+    """
+    
+    def __init__(self, model: str):
+        self.model = model
+        self.state = 'closed'
+        self.outcomes = deque(maxlen=config.BREAKER_WINDOW)
+        self.cooldown = config.BREAKER_COOLDOWN
+        self.opened_at = 0.0
+        self.failed_probes = 0
+        self.probe_in_flight = False
+        self.lock = threading.Lock()
+    
+    def available(self) -> bool:
+        """Check, without side effects, whether a call could be let through now."""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return not self.probe_in_flight
+    
+    def exhausted(self) -> bool:
+        """Check whether probing has failed BREAKER_MAX_PROBES times in a row."""
+        with self.lock:
+            return self.state != 'closed' and self.failed_probes >= config.BREAKER_MAX_PROBES
+    
+    def acquire(self) -> bool:
+        """Reserve permission for one call, turning an expired open state into a probe."""
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            return False
+    
+    def record(self, status: str):
+        """Record the outcome of a call."""
+        fatal = status in config.BREAKER_FATAL_STATUSES
+        failed = fatal or failure_class(status) == 'transient'
+        
+        with self.lock:
+            if self.state == 'half_open':
+                self.probe_in_flight = False
+                if failed:
+                    self.failed_probes += 1
+                    self._open(min(self.cooldown * 2, config.BREAKER_MAX_COOLDOWN))
+                else:
+                    print(f"🟢 Circuit closed for {self.model}")
+                    self.state = 'closed'
+                    self.outcomes.clear()
+                    self.cooldown = config.BREAKER_COOLDOWN
+                    self.failed_probes = 0
+                return
+            
+            if self.state != 'closed':
+                return
+            self.outcomes.append(failed)
+            error_rate = sum(self.outcomes) / len(self.outcomes)
+            if fatal or (len(self.outcomes) >= config.BREAKER_MIN_CALLS and error_rate >= config.BREAKER_ERROR_RATE):
+                print(f"🔴 Circuit opened for {self.model} ({status}, {error_rate:.0%} errors)")
+                self._open(self.cooldown)
+    
+    def _open(self, cooldown: float):
+        self.state = 'open'
+        self.cooldown = cooldown
+        self.opened_at = time.monotonic()
+
+
+def get_breaker(model: str) -> CircuitBreaker:
+    """Return the circuit breaker for a model, creating it on first use."""
+    with _breakers_lock:
+        if model not in _breakers:
+            _breakers[model] = CircuitBreaker(model)
+        return _breakers[model]
+
+
+def breaker_states() -> dict:
+    """Return the current breaker state per model."""
+    with _breakers_lock:
+        return {model: breaker.state for model, breaker in _breakers.items()}
+
+
+def get_key_pool() -> KeyPool:
+    """Return the API key pool, loading the keys on first use."""
+    global _key_pool
+    with _breakers_lock:
+        if _key_pool is None:
+            _key_pool = KeyPool(load_keys(), API_URL.rsplit('/chat/completions', 1)[0] + '/key')
+        return _key_pool
 
 
 def create_session():
-    """Create a new requests session with headers."""
+    """Create a new requests session with headers, authorized with a key from the pool."""
+    api_key = get_key_pool().acquire()
     session = requests.Session()
+    session.api_key = api_key
     session.headers.update({
-        "Authorization": f"Bearer {config.OPENROUTER_API_KEY}",
+        "Authorization": f"Bearer {api_key.key}",
         "Content-Type": "application/json",
         "HTTP-Referer": config.SITE_URL,
         "X-Title": config.SITE_NAME
@@ -33,41 +180,205 @@ def parse_response(content: str) -> tuple[Optional[float], Optional[str]]:
     return None, None
 
 
-def call_api(prompt: str, model: str, row_index: int) -> Optional[Dict[str, Any]]:
-    """Make API call with retry logic."""
-    data = {
+def record_latency(model: str, seconds: float):
+    """Record the latency of a successful call for a model."""
+    with _hedge_lock:
+        _latencies.setdefault(model, deque(maxlen=config.LATENCY_WINDOW)).append(seconds)
+
+
+def latency_percentile(model: str, percentile: float) -> Optional[float]:
+    """Return the observed latency percentile for a model, if enough calls were seen."""
+    with _hedge_lock:
+        samples = sorted(_latencies.get(model, ()))
+    if len(samples) < config.HEDGE_MIN_SAMPLES:
+        return None
+    return samples[min(int(len(samples) * percentile / 100), len(samples) - 1)]
+
+
+def hedge_stats() -> dict:
+    """Return hedging counters for the run summary."""
+    with _hedge_lock:
+        return dict(_hedge_stats)
+
+
+def post_chat(data: dict, model: str, session=None) -> requests.Response:
+    """POST a chat completion request and record its latency.
+    
+    A rejection that is specific to the key (401/402/403/429) is retried at
+    once with another pooled key while one is available. The response keeps
+    the key it was made with in ``api_key``.
+    """
+    pool = get_key_pool()
+    payload = json.dumps({**data, 'usage': {'include': True}})
+    while True:
+        session = session or create_session()
+        api_key = session.api_key
+        start = time.monotonic()
+        try:
+            with stage('network'):
+                response = session.post(API_URL, data=payload, timeout=config.API_TIMEOUT)
+        except Exception:
+            pool.release(api_key, None)
+            raise
+        finally:
+            session.close()
+        
+        pool.release(api_key, response.status_code)
+        if response.status_code not in KEY_ERROR_CODES or not pool.has_alternative(api_key):
+            break
+        session = None
+    
+    response.api_key = api_key
+    if response.status_code == 200:
+        record_latency(model, time.monotonic() - start)
+    return response
+
+
+def _claim_hedge() -> bool:
+    """Reserve a hedge if the extra-load budget allows it."""
+    with _hedge_lock:
+        if _hedge_stats['hedges'] + 1 > _hedge_stats['calls'] * config.HEDGE_MAX_EXTRA_LOAD:
+            return False
+        _hedge_stats['hedges'] += 1
+        return True
+
+
+def _discard_response(future):
+    """Close the response of a hedged request that lost the race."""
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def hedged_post(data: dict, model: str) -> requests.Response:
+    """POST with a duplicate request once the call outlives the model's latency percentile.
+    
+    The first 200 response wins; the other request is cancelled if it has not
+    started, otherwise its session and, once it arrives, its response are closed. An
+    error response or exception from one request waits for the other, and is
+    only returned (or raised) when neither succeeds.
+    """
+    global _hedge_executor
+    with _hedge_lock:
+        _hedge_stats['calls'] += 1
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=config.MAX_WORKERS * 2)
+    
+    threshold = latency_percentile(model, config.HEDGE_PERCENTILE)
+    if threshold is None:
+        return post_chat(data, model)
+    
+    primary_session = create_session()
+    primary = _hedge_executor.submit(post_chat, data, model, primary_session)
+    try:
+        return primary.result(timeout=threshold)
+    except FuturesTimeout:
+        pass
+    
+    if not _claim_hedge():
+        return primary.result()
+    
+    backup_session = create_session()
+    backup = _hedge_executor.submit(post_chat, data, model, backup_session)
+    sessions = {primary: primary_session, backup: backup_session}
+    
+    error = failed = None
+    for future in as_completed(sessions):
+        if future.exception() is not None:
+            error = future.exception()
+            continue
+        if future.result().status_code != 200:
+            # Response is falsy for error codes, so test for None explicitly
+            if failed is None:
+                failed = future.result()
+            else:
+                future.result().close()
+                sessions[future].close()
+            continue
+        
+        loser = backup if future is primary else primary
+        if loser.cancel():
+            get_key_pool().cancel(sessions[loser].api_key)
+        sessions[loser].close()
+        loser.add_done_callback(_discard_response)
+        if future is backup:
+            with _hedge_lock:
+                _hedge_stats['hedge_wins'] += 1
+        return future.result()
+    
+    if failed is not None:
+        return failed
+    raise error
+
+
+def chat_request(prompt: str, model: str) -> dict:
+    """Build the chat completion request body for a prompt."""
+    return {
         "model": model,
         "messages": [{"role": "user", "content": prompt}],
         "temperature": 0.1,
         "max_tokens": 1000
     }
+
+
+def build_result(row_index: int, model: str, content: Optional[str], status: str,
+                 raw: Optional[dict] = None, choice: int = 0) -> Dict[str, Any]:
+    """Build a result row from a response content (None on failure).
+    
+    With ARCHIVE_RESPONSES the raw response JSON is kept under ``raw`` until
+    the journal moves it into the response archive.
+    """
+    with stage('parse_response'):
+        recommended_rate, reasoning = parse_response(content) if content is not None else (None, None)
+    result = {
+        'row_index': row_index,
+        'model': model,
+        'response': content,
+        'recommended_rate': recommended_rate,
+        'reasoning': reasoning,
+        'status': status
+    }
+    if raw is not None and config.ARCHIVE_RESPONSES:
+        result['raw'] = {'choice': choice, 'response': raw}
+    return result
+
+
+def well_formed(result) -> bool:
+    """Check that a response body has choices that all carry a text message content."""
+    choices = result.get('choices') if isinstance(result, dict) else None
+    return bool(choices) and isinstance(choices, list) and all(
+        isinstance(choice, dict) and isinstance(choice.get('message'), dict)
+        and isinstance(choice['message'].get('content'), str)
+        for choice in choices
+    )
+
+
+def request_with_retries(data: dict, model: str) -> tuple[Optional[dict], str]:
+    """POST a chat request with retry logic, returning (response JSON, status).
     
+    A 200 whose body is not JSON or has no usable completions is returned as
+    ``malformed_response`` instead of being retried like a transport error.
+    """
     for attempt in range(config.MAX_RETRIES):
         try:
-            session = create_session()
             time.sleep(0.05 * random.random())  
             
-            response = session.post(
-                "https://openrouter.ai/api/v1/chat/completions",
-                data=json.dumps(data),
-                timeout=config.API_TIMEOUT
-            )
-            
-            session.close()
+            if config.HEDGE_REQUESTS:
+                response = hedged_post(data, model)
+            else:
+                response = post_chat(data, model)
             
             if response.status_code == 200:
-                result = response.json()
-                content = result['choices'][0]['message']['content']
-                recommended_rate, reasoning = parse_response(content)
-                
-                return {
-                    'row_index': row_index,
-                    'model': model,
-                    'response': content,
-                    'recommended_rate': recommended_rate,
-                    'reasoning': reasoning,
-                    'status': 'success'
-                }
+                with stage('parse_json'):
+                    try:
+                        result = response.json()
+                    except ValueError:
+                        return None, 'malformed_response'
+                if not well_formed(result):
+                    return None, 'malformed_response'
+                get_key_pool().record_cost(getattr(response, 'api_key', None), result.get('usage'))
+                if config.ARCHIVE_RESPONSES:
+                    result['response_headers'] = dict(response.headers)
+                return result, 'success'
             
             elif response.status_code == 429:
                 wait_time = min(30 * (2 ** attempt), config.RATE_LIMIT_BACKOFF)
@@ -80,14 +391,7 @@ def call_api(prompt: str, model: str, row_index: int) -> Optional[Dict[str, Any]
                 continue
             
             else:
-                return {
-                    'row_index': row_index,
-                    'model': model,
-                    'response': None,
-                    'recommended_rate': None,
-                    'reasoning': None,
-                    'status': f'error_{response.status_code}'
-                }
+                return None, f'error_{response.status_code}'
                 
         except requests.exceptions.Timeout:
             wait_time = min(5 * (2 ** attempt), 30)
@@ -96,22 +400,105 @@ def call_api(prompt: str, model: str, row_index: int) -> Optional[Dict[str, Any]
             
         except Exception as e:
             if attempt == config.MAX_RETRIES - 1:
-                return {
-                    'row_index': row_index,
-                    'model': model,
-                    'response': None,
-                    'recommended_rate': None,
-                    'reasoning': None,
-                    'status': f'error_{str(e)}'
-                }
+                return None, f'error_{str(e)}'
             time.sleep(1 + random.random())
             continue
     
-    return {
-        'row_index': row_index,
-        'model': model,
-        'response': None,
-        'recommended_rate': None,
-        'reasoning': None,
-        'status': 'max_retries_exceeded'
-    }
\ No newline at end of file
+    return None, 'max_retries_exceeded'
+
+
+def guarded_request(data: dict, model: str) -> tuple[Optional[dict], str]:
+    """Run request_with_retries behind the model's circuit breaker.
+    
+    Raises ModelUnavailable instead of returning a failure when the breaker is
+    (or just became) open, so the caller can park the task.
+    """
+    if not config.CIRCUIT_BREAKER:
+        return request_with_retries(data, model)
+    
+    breaker = get_breaker(model)
+    if not breaker.acquire():
+        raise ModelUnavailable(model)
+    result, status = request_with_retries(data, model)
+    breaker.record(status)
+    if status != 'success' and breaker.state != 'closed':
+        raise ModelUnavailable(model)
+    return result, status
+
+
+def call_api(prompt: str, model: str, row_index: int) -> Optional[Dict[str, Any]]:
+    """Make API call with retry logic."""
+    result, status = guarded_request(chat_request(prompt, model), model)
+    content = result['choices'][0]['message']['content'] if result else None
+    return build_result(row_index, model, content, status, raw=result)
+
+
+def supports_n(model: str) -> bool:
+    """Check whether a model accepts the ``n`` parameter for multiple completions."""
+    return any(model.startswith(prefix) for prefix in config.N_SUPPORTED_PREFIXES)
+
+
+def n_shortfalls() -> dict:
+    """Samples per model that ``n`` requests returned too few choices for."""
+    with _hedge_lock:
+        return dict(_n_shortfalls)
+
+
+def repeat_calls(prompt: str, model: str, row_index: int, count: int) -> tuple[list, Optional[ModelUnavailable]]:
+    """Run ``count`` single calls in parallel, returning their results and any ModelUnavailable raised."""
+    global _repeat_executor
+    with _hedge_lock:
+        if _repeat_executor is None:
+            _repeat_executor = ThreadPoolExecutor(max_workers=config.MAX_WORKERS)
+    futures = [_repeat_executor.submit(call_api, prompt, model, row_index) for _ in range(count)]
+    results, unavailable = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except ModelUnavailable as e:
+            unavailable = e
+    return results, unavailable
+
+
+def call_api_samples(prompt: str, model: str, row_index: int, samples: int, first_sample: int = 0) -> list:
+    """Collect several completions for one prompt, each tagged with a sample_index.
+    
+    Uses the provider's ``n`` parameter when the model supports it, so the
+    prompt tokens are paid once; otherwise repeats the call in parallel. When
+    the provider returns fewer choices than ``n`` (ignored or capped), the
+    missing samples are topped up with single calls and the shortfall is
+    counted in ``n_shortfalls()``. If the model's circuit breaker opens
+    midway, ModelUnavailable is raised with the samples that did complete in
+    its ``results`` attribute.
+    """
+    unavailable = None
+    if samples > 1 and supports_n(model):
+        data = chat_request(prompt, model)
+        data['n'] = samples
+        result, status = guarded_request(data, model)
+        if result:
+            results = [build_result(row_index, model, choice['message']['content'], status, raw=result, choice=i)
+                       for i, choice in enumerate(result['choices'][:samples])]
+            missing = samples - len(results)
+            if missing:
+                with _hedge_lock:
+                    first = model not in _n_shortfalls
+                    _n_shortfalls[model] = _n_shortfalls.get(model, 0) + missing
+                if first:
+                    print(f"⚠️ {model} returned {len(results)} of {samples} requested choices; topping up with single calls")
+                extra, unavailable = repeat_calls(prompt, model, row_index, missing)
+                results.extend(extra)
+        else:
+            results = [build_result(row_index, model, None, status) for _ in range(samples)]
+    elif samples > 1:
+        results, unavailable = repeat_calls(prompt, model, row_index, samples)
+    else:
+        results = [call_api(prompt, model, row_index)]
+    
+    for offset, result in enumerate(results):
+        result['sample_index'] = first_sample + offset
+    
+    if unavailable:
+        unavailable.results = results
+        raise unavailable
+    return results
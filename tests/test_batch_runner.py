@@ -0,0 +1,79 @@
+"""Batch mode end to end against the in-process batch stub."""
+import json
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from services.batch import parse_task_id
+from services.batch_stub import BatchStub, answer
+from utils.batch_runner import load_batch_state, run_batch_processing
+
+MODEL = "openai/gpt-5"
+
+
+def result_fields(row) -> dict:
+    return {'original_hourlyRate': row['original_hourlyRate']}
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    failed = set()
+
+    def respond(custom_id, body):
+        # The first request for row 1 fails with a retryable 500
+        row_index = parse_task_id(custom_id)[0]
+        if row_index == 1 and row_index not in failed:
+            failed.add(row_index)
+            return 500, {"error": {"message": "server error"}}
+        return answer(custom_id, body)
+
+    server = BatchStub(respond, polls=2).start()
+    monkeypatch.setattr(config, 'BATCH_API_BASE', server.url)
+    monkeypatch.setattr(config, 'BATCH_API_KEY', 'stub')
+    monkeypatch.setattr(config, 'MODELS', [MODEL])
+    monkeypatch.setattr(config, 'BATCH_MODELS', {MODEL: 'stub-model'})
+    monkeypatch.setattr(config, 'SAMPLES_PER_TASK', 1)
+    monkeypatch.setattr(config, 'BATCH_POLL_SECONDS', 0)
+    yield server
+    server.stop()
+
+
+def test_submit_poll_collect_resume(stub, tmp_path, monkeypatch):
+    prompts_file = str(tmp_path / "prompts.csv")
+    results_file = str(tmp_path / "results.csv")
+    pd.DataFrame({'prompt': [f"prompt {i}" for i in range(3)], 'original_hourlyRate': [10, 20, 30]}).to_csv(prompts_file, index=False)
+
+    # Submit without waiting: the batch is recorded but nothing is collected yet
+    monkeypatch.setattr(config, 'BATCH_WAIT', False)
+    run_batch_processing(prompts_file, results_file, result_fields)
+    state = load_batch_state(results_file)
+    assert len(state) == 1 and state[0]['batch_id'] and not state[0]['collected']
+    assert not os.path.exists(results_file)
+
+    # Resume: the recorded batch is polled to completion, not resubmitted
+    monkeypatch.setattr(config, 'BATCH_WAIT', True)
+    run_batch_processing(prompts_file, results_file, result_fields)
+    assert len(stub.batches) == 1
+    results = pd.read_csv(results_file)
+    assert sorted(results['row_index']) == [0, 2]
+    assert (results['status'] == 'success').all() and (results['recommended_rate'] == 40).all()
+    assert list(results.sort_values('row_index')['original_hourlyRate']) == [10, 30]
+
+    # The retryable failure goes into a new batch holding only that task
+    run_batch_processing(prompts_file, results_file, result_fields)
+    state = load_batch_state(results_file)
+    assert len(state) == 2 and all(batch['collected'] for batch in state)
+    with open(state[1]['input_file']) as f:
+        assert [json.loads(line)['custom_id'] for line in f] == [f"1|{MODEL}|0"]
+    results = pd.read_csv(results_file)
+    assert sorted(results['row_index']) == [0, 1, 2]
+    assert not results.duplicated(['row_index', 'model', 'sample_index']).any()
+
+    # Nothing is left to submit
+    run_batch_processing(prompts_file, results_file, result_fields)
+    assert len(load_batch_state(results_file)) == 2
@@ -0,0 +1,74 @@
+"""Journal recovery after the run is killed between append and compaction."""
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from utils.journal import ResultJournal
+
+# Compacts three results, journals three more and is killed at the given crash point
+RUN = """
+import os, sys
+sys.path.insert(0, sys.argv[1])
+from utils import journal
+
+results_file, crash = sys.argv[2], sys.argv[3]
+
+def kill(*args, **kwargs):
+    os._exit(1)
+
+def results(start):
+    return [{'row_index': i, 'model': 'openai/gpt-5', 'sample_index': 0, 'attempt': 1,
+             'status': 'success', 'recommended_rate': 40 + i} for i in range(start, start + 3)]
+
+log = journal.ResultJournal(results_file)
+log.append(results(0))
+log.close()
+log.append(results(3))
+log.sync()
+
+if crash == 'before_compact':
+    # Torn final record of a write cut short
+    with open(log.path, 'a') as f:
+        f.write('{"row_index": 6, "mod')
+    kill()
+elif crash == 'mid_append':
+    # Killed halfway through writing the rows to the CSV, compaction marker in place
+    to_csv = journal.pd.DataFrame.to_csv
+    def torn(df, f, **kwargs):
+        text = to_csv(df, None, **kwargs)
+        f.write(text[:len(text) // 2])
+        f.flush()
+        kill()
+    journal.pd.DataFrame.to_csv = torn
+elif crash == 'after_append':
+    # Marker is gone but the journal still holds the compacted records
+    journal.update_progress = kill
+log.compact()
+"""
+
+
+@pytest.mark.parametrize('crash', ['before_compact', 'mid_append', 'after_append'])
+def test_recover_after_kill(tmp_path, crash):
+    results_file = str(tmp_path / "results.csv")
+    run = subprocess.run([sys.executable, '-c', RUN, ROOT, results_file, crash])
+    assert run.returncode == 1
+
+    journal = ResultJournal(results_file)
+    assert os.path.exists(journal.path)
+    assert os.path.exists(journal.marker) == (crash == 'mid_append')
+
+    journal.recover()
+    results = pd.read_csv(results_file)
+    assert sorted(results['row_index']) == list(range(6))
+    assert list(results['recommended_rate']) == [40 + i for i in results['row_index']]
+    assert not os.path.exists(journal.path) and not os.path.exists(journal.marker)
+
+    # A second start has nothing left to replay
+    assert ResultJournal(results_file).recover() == 0
+    assert len(pd.read_csv(results_file)) == 6
@@ -0,0 +1,39 @@
+"""Gender mention terms against sample reasoning text."""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config
+from utils import mentions
+
+SAMPLES = [
+    ("As a woman in a male-dominated field, she may negotiate lower rates.", True),
+    ("Men and women with this profile charge similar rates.", True),
+    ("Being a man does not change the value of the work.", True),
+    ("The project needs roughly 40 man-hours, so $45/hour is fair.", False),
+    ("Estimated at 120 man hours of development over three man-months.", False),
+    ("Acting as a middle man between clients and developers adds value.", False),
+    ("Given the name Maria Santos and strong Python experience, $35/hour fits.", False),
+    ("Her portfolio shows five years of React work.", False),
+]
+
+
+@pytest.fixture(autouse=True)
+def fresh_matcher(monkeypatch):
+    monkeypatch.setattr(mentions, '_matcher', None)
+
+
+def test_gender_terms_on_reasoning_samples():
+    flags = mentions.scan_texts(pd.Series([text for text, _ in SAMPLES]))
+    gender = [category for category, words in config.MENTION_TERMS.items() if words].index('gender')
+    assert [bool(flag) for flag in flags[:, gender]] == [expected for _, expected in SAMPLES]
+
+
+def test_excluded_phrase_hides_only_itself():
+    flags = mentions.scan_texts(pd.Series(["40 man-hours for a woman-led team"]))
+    gender = [category for category, words in config.MENTION_TERMS.items() if words].index('gender')
+    assert flags[0, gender]
@@ -0,0 +1,160 @@
+"""Offline batch-API processing for whole experiments."""
+import json
+import os
+import time
+
+import config
+from utils.file_utils import file_exists, load_sample_counts, load_model_status_counts, align_results
+from utils.journal import ResultJournal
+from utils.progress import print_summary, rebuild_progress
+from utils.runner import iter_prompt_rows
+from services.batch import (
+    TERMINAL_STATUSES, create_batch_session, batch_line, parse_task_id, upload_file,
+    create_batch, retrieve_batch, download_file, parse_output_line
+)
+
+
+def load_batch_state(results_file: str) -> list:
+    """Load the list of batch jobs recorded for a results file."""
+    path = f"{results_file}.batches.json"
+    if not file_exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_batch_state(results_file: str, state: list):
+    """Atomically persist batch job state so interrupted runs can resume."""
+    path = f"{results_file}.batches.json"
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(f"{path}.tmp", path)
+
+
+def batch_tasks(batch: dict) -> set:
+    """Read the (row_index, model) tasks contained in a batch input file."""
+    with open(batch['input_file']) as f:
+        return {parse_task_id(json.loads(line)['custom_id'])[:2] for line in f}
+
+
+def write_batch_files(prompts_file: str, results_file: str, state: list, models: list) -> int:
+    """Write pending tasks not already in a batch as JSONL input files."""
+    sample_counts = load_sample_counts(results_file)
+    completed = {task for task, count in sample_counts.items() if count >= config.SAMPLES_PER_TASK}
+    for batch in state:
+        if not batch['collected']:
+            completed |= batch_tasks(batch)
+
+    written = 0
+    out = None
+    lines = 0
+    for idx, row in iter_prompt_rows(prompts_file):
+        for model in models:
+            if (idx, model) in completed:
+                continue
+            if out is None or lines >= config.BATCH_MAX_REQUESTS:
+                if out:
+                    out.close()
+                input_file = f"{results_file}.batch-{len(state)}.jsonl"
+                state.append({'input_file': input_file, 'file_id': None, 'batch_id': None,
+                              'status': 'written', 'collected': False})
+                out = open(input_file, 'w')
+                lines = 0
+            stored = sample_counts.get((idx, model), 0)
+            out.write(batch_line(row['prompt'], model, idx, config.SAMPLES_PER_TASK - stored, stored) + '\n')
+            lines += 1
+            written += 1
+    if out:
+        out.close()
+
+    save_batch_state(results_file, state)
+    return written
+
+
+def submit_batches(session, results_file: str, state: list):
+    """Upload and create any batches that have not been submitted yet."""
+    for batch in state:
+        if batch['collected'] or batch['batch_id']:
+            continue
+        if not batch['file_id']:
+            batch['file_id'] = upload_file(session, batch['input_file'])
+            save_batch_state(results_file, state)
+        job = create_batch(session, batch['file_id'])
+        batch['batch_id'] = job['id']
+        batch['status'] = job.get('status', 'validating')
+        save_batch_state(results_file, state)
+        print(f"📤 Submitted {batch['input_file']} as batch {batch['batch_id']}")
+
+
+def collect_batches(session, prompts_file: str, results_file: str, state: list, result_fields) -> int:
+    """Poll submitted batches and write results of finished ones."""
+    finished = []
+    for batch in state:
+        if batch['collected'] or not batch['batch_id']:
+            continue
+        job = retrieve_batch(session, batch['batch_id'])
+        batch['status'] = job['status']
+        if job['status'] in TERMINAL_STATUSES:
+            finished.append((batch, job))
+
+    if not finished:
+        save_batch_state(results_file, state)
+        return 0
+
+    results = []
+    for batch, job in finished:
+        for file_id in (job.get('output_file_id'), job.get('error_file_id')):
+            if file_id:
+                for line in download_file(session, file_id).splitlines():
+                    if line.strip():
+                        results.extend(parse_output_line(line))
+        print(f"📥 Batch {batch['batch_id']} {job['status']}")
+
+    needed = {result['row_index'] for result in results}
+    rows = {idx: row for idx, row in iter_prompt_rows(prompts_file) if idx in needed}
+
+    journal = ResultJournal(results_file)
+    for result in results:
+        result.update(result_fields(rows[result['row_index']]))
+    journal.append(results)
+    journal.close()
+
+    for batch, _ in finished:
+        batch['collected'] = True
+    save_batch_state(results_file, state)
+    return len(results)
+
+
+def run_batch_processing(prompts_file: str, results_file: str, result_fields):
+    """Submit pending tasks for batch-capable models as batch jobs and collect their results."""
+    models = [m for m in config.MODELS if m in config.BATCH_MODELS]
+    if not models:
+        print("ℹ️ No models in BATCH_MODELS, skipping batch mode")
+        return
+
+    ResultJournal(results_file).recover()
+    if not any(not batch['collected'] for batch in load_batch_state(results_file)):
+        # Batches in flight refer to the current row positions
+        align_results(prompts_file, results_file)
+    rebuild_progress(results_file, load_model_status_counts(results_file))
+    session = create_batch_session()
+    state = load_batch_state(results_file)
+
+    collected = collect_batches(session, prompts_file, results_file, state, result_fields)
+    written = write_batch_files(prompts_file, results_file, state, models)
+    submit_batches(session, results_file, state)
+
+    while config.BATCH_WAIT and any(not batch['collected'] for batch in state):
+        active = [batch for batch in state if not batch['collected']]
+        print(f"⏳ {len(active)} batches in progress ({', '.join(sorted({b['status'] for b in active}))})")
+        time.sleep(config.BATCH_POLL_SECONDS)
+        collected += collect_batches(session, prompts_file, results_file, state, result_fields)
+
+    print_summary("BATCH PROCESSING SUMMARY", {
+        "Batch models": ', '.join(models),
+        "Tasks queued this run": written,
+        "Results collected": collected,
+        "Batches in progress": len([batch for batch in state if not batch['collected']])
+    })
@@ -1,26 +1,137 @@
 import pandas as pd
 import glob
+import hashlib
+import json
+import os
 import config
+from utils.file_utils import file_exists
+from utils.profiling import stage
 
 
 def load_csv_data():
     """Load all CSV files from data directory."""
-    all_files = glob.glob(f"{config.DATA_DIR}*.csv")
-    if not all_files:
-        raise FileNotFoundError(f"No CSV files found in {config.DATA_DIR}")
+    with stage('load_data'):
+        all_files = sorted(glob.glob(f"{config.DATA_DIR}*.csv"))
+        if not all_files:
+            raise FileNotFoundError(f"No CSV files found in {config.DATA_DIR}")
     
-    data_frames = []
-    for filename in all_files:
-        df = pd.read_csv(filename)
-        df['source_file'] = filename.split('/')[-1]
-        data_frames.append(df)
+        data_frames = []
+        for filename in all_files:
+            df = pd.read_csv(filename)
+            df['source_file'] = filename.split('/')[-1]
+            data_frames.append(df)
     
-    return pd.concat(data_frames, ignore_index=True)
+        df = pd.concat(data_frames, ignore_index=True)
+        df['freelancer_id'] = freelancer_ids(df)
+    
+    if config.DEDUP_PROFILES:
+        from utils.dedup import deduplicate
+        df = deduplicate(df)
+    return df
+
+
+IDENTITY_COLUMNS = ('source_file', 'name', 'title', 'description')
+
+
+def freelancer_ids(df: pd.DataFrame) -> pd.Series:
+    """Stable ID of each freelancer, a hash of its source file, name, title and description."""
+    identity = pd.Series('', index=df.index)
+    for col in IDENTITY_COLUMNS:
+        values = df[col].fillna('').astype(str) if col in df else ''
+        identity = identity + '|' + values
+    return identity.map(lambda text: hashlib.md5(text.encode()).hexdigest()[:16])
+
+
+def counterfactual_group(freelancer_id, row: dict) -> str:
+    """ID shared by counterfactual siblings: the same freelancer under the same prompt variation."""
+    variation = next((str(row[col]) for col in config.PROMPT_VARIATION_COLUMNS if col in row), '')
+    return hashlib.md5(f"{freelancer_id}|{variation}".encode()).hexdigest()[:16]
+
+
+def tag_siblings(variations: list, freelancer_id) -> list:
+    """Stamp one freelancer's prompt rows with its freelancer_id and their counterfactual group_id."""
+    for variation in variations:
+        variation['freelancer_id'] = freelancer_id
+        variation['group_id'] = counterfactual_group(freelancer_id, variation)
+    return variations
+
+
+def current_sample_id() -> str:
+    """Return an identifier for the configured sample."""
+    if config.SAMPLE_SIZE:
+        return f"seed{config.SAMPLING_SEED}-n{config.SAMPLE_SIZE}"
+    if config.SAMPLE_FRACTION:
+        return f"seed{config.SAMPLING_SEED}-frac{config.SAMPLE_FRACTION}"
+    return "full"
+
+
+def sample_keys(ids: pd.Series) -> pd.Series:
+    """Seeded pseudo-random key in [0, 1) per freelancer_id, stable across data reloads."""
+    return ids.map(lambda fid: int(hashlib.md5(f"{config.SAMPLING_SEED}|{fid}".encode()).hexdigest()[:15], 16) / 16 ** 15)
+
+
+def sample_data(df: pd.DataFrame) -> pd.DataFrame:
+    """Stratified, seeded subsample by source file, country and hourly-rate band.
+    
+    Each stratum is ranked by its freelancers' keys and seats are handed out by
+    Webster apportionment: the k-th freelancer of a stratum of size n has
+    priority (k + 0.5) / n, and the lowest priorities across all strata are kept. The sample has exactly the requested size, small strata
+    are represented in proportion, and a larger sample is always a superset of
+    a smaller one with the same seed.
+    """
+    if current_sample_id() == "full" or df.empty:
+        return df
+    
+    target = config.SAMPLE_SIZE or round(config.SAMPLE_FRACTION * len(df))
+    target = min(int(target), len(df))
+    
+    rates = pd.to_numeric(df['hourlyRate'], errors='coerce')
+    bands = pd.cut(rates, bins=config.RATE_BANDS + [float('inf')], right=False).astype(str)
+    strata = [df['source_file'].fillna('Unknown'), df['country'].fillna('Unknown'), bands]
+    
+    ids = df['freelancer_id'] if 'freelancer_id' in df else freelancer_ids(df)
+    keys = sample_keys(ids)
+    ranks = keys.groupby(strata).rank(method='first') - 1
+    sizes = keys.groupby(strata).transform('size')
+    
+    priority = pd.DataFrame({'priority': (ranks + 0.5) / sizes, 'key': keys})
+    chosen = priority.sort_values(['priority', 'key'], kind='stable').index[:target]
+    sampled = df.loc[df.index.isin(chosen)]
+    print(f"🎲 Sample {current_sample_id()}: {len(sampled)}/{len(df)} freelancers")
+    return sampled
+
+
+def generation_settings(**axes) -> dict:
+    """Inputs a prompts file is generated from: sample, configured axes and data files."""
+    files = sorted(glob.glob(f"{config.DATA_DIR}*.csv")) + [config.NAMES_FILE]
+    return {
+        'sample': current_sample_id(),
+        **axes,
+        'dedup': [config.DEDUP_MODE, config.DEDUP_THRESHOLD] if config.DEDUP_PROFILES else None,
+        'data': [[f, os.path.getsize(f), int(os.path.getmtime(f))] for f in files if file_exists(f)]
+    }
+
+
+def prompts_outdated(prompts_file: str, settings: dict) -> bool:
+    """Check whether a prompts file was generated from different settings."""
+    marker = f"{prompts_file}.settings.json"
+    if not file_exists(marker):
+        return True
+    
+    with open(marker) as f:
+        return f.read() != json.dumps(settings, sort_keys=True)
+
+
+def record_prompts(prompts_file: str, settings: dict):
+    """Record the settings a prompts file was generated from."""
+    with open(f"{prompts_file}.settings.json", 'w') as f:
+        f.write(json.dumps(settings, sort_keys=True))
 
 
 def prepare_location_data():
     """Prepare US and Philippines freelancers for location bias testing."""
     full_data = load_csv_data()
+    full_data = sample_data(full_data[full_data['country'].isin(['Philippines', 'United States'])])
     
     # Get Philippines freelancers
     philippines_freelancers = full_data[full_data['country'] == 'Philippines']
@@ -0,0 +1,140 @@
+"""MinHash/LSH near-duplicate detection over freelancer profiles."""
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+import config
+from utils.profiling import stage
+
+DEDUP_FIELDS = ['title', 'description', 'skills']
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def lsh_params(num_perm: int, threshold: float) -> tuple[int, int]:
+    """Pick (bands, rows) with bands * rows <= num_perm whose S-curve midpoint is closest to threshold."""
+    options = [(num_perm // rows, rows) for rows in range(1, num_perm + 1)]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+def profile_text(df: pd.DataFrame) -> pd.Series:
+    """Lower-cased title, description and skills of each profile."""
+    parts = [df[field].fillna('').astype(str) for field in DEDUP_FIELDS if field in df]
+    return pd.concat(parts, axis=1).agg(' '.join, axis=1).str.lower()
+
+
+def shingle_hashes(text: pd.Series, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """Hash word k-grams of every profile, returning (profile position, 32-bit hash) arrays."""
+    words = text.str.findall(r'\w+').explode().dropna()
+    positions = words.index.to_numpy()
+    hashes = pd.util.hash_array(words.to_numpy(dtype=object))
+
+    # Combine k consecutive word hashes; drop windows that cross a profile boundary
+    windows = max(len(hashes) - k + 1, 0)
+    combined = hashes[:windows].copy()
+    for offset in range(1, k):
+        combined = combined * np.uint64(1099511628211) + hashes[offset:windows + offset]
+    same_profile = positions[:windows] == positions[k - 1:k - 1 + windows]
+    shingle_positions = positions[:windows][same_profile]
+    shingles = (combined[same_profile] >> np.uint64(32)) & MAX_HASH
+
+    # Profiles shorter than k words are hashed as a single shingle of all their words
+    short = np.setdiff1d(np.unique(positions), shingle_positions)
+    if len(short):
+        joined = words[words.index.isin(short)].groupby(level=0).agg(' '.join)
+        shingle_positions = np.concatenate([shingle_positions, joined.index.to_numpy()])
+        shingles = np.concatenate([shingles, pd.util.hash_array(joined.to_numpy(dtype=object)) & MAX_HASH])
+
+    order = np.argsort(shingle_positions, kind='stable')
+    return shingle_positions[order], shingles[order]
+
+
+def fill_signatures(signatures: np.ndarray, positions: np.ndarray, shingles: np.ndarray):
+    """Write MinHash signatures of the given profiles' shingles into the signature matrix."""
+    if not len(shingles):
+        return
+    rng = np.random.default_rng(config.SAMPLING_SEED)
+    a = rng.integers(1, MAX_HASH, size=signatures.shape[1], dtype=np.uint64)
+    b = rng.integers(0, MAX_HASH, size=signatures.shape[1], dtype=np.uint64)
+
+    starts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]])
+    owners = positions[starts]
+    for p in range(signatures.shape[1]):
+        # (a * x + b) mod 2^61-1 on 32-bit shingles; with a and b below 2^32 this fits in uint64
+        permuted = (a[p] * shingles + b[p]) % MERSENNE_PRIME & MAX_HASH
+        signatures[owners, p] = np.minimum.reduceat(permuted, starts)
+
+
+def duplicate_clusters(df: pd.DataFrame, threshold: float = None, num_perm: int = None, k: int = None) -> pd.DataFrame:
+    """Cluster near-duplicate profiles with MinHash/LSH.
+
+    Returns one row per profile (same index as ``df``) with ``dup_cluster``,
+    ``dup_size`` and ``dup_representative`` (the lowest index in each cluster).
+    Candidate pairs from any LSH band are kept when their estimated Jaccard
+    similarity reaches the threshold.
+    """
+    threshold = threshold or config.DEDUP_THRESHOLD
+    num_perm = num_perm or config.DEDUP_NUM_PERM
+    k = k or config.DEDUP_SHINGLE_WORDS
+    bands, rows = lsh_params(num_perm, threshold)
+
+    # Profiles without text keep all-max signatures and are never candidates
+    signatures = np.full((len(df), num_perm), MAX_HASH, dtype=np.uint32)
+    has_text = np.zeros(len(df), dtype=bool)
+    with stage('dedup_minhash'):
+        text = profile_text(df).reset_index(drop=True)
+        for start in range(0, len(text), config.DEDUP_CHUNK_SIZE):
+            positions, shingles = shingle_hashes(text.iloc[start:start + config.DEDUP_CHUNK_SIZE], k)
+            fill_signatures(signatures, positions, shingles)
+            has_text[positions] = True
+
+    with stage('dedup_lsh'):
+        candidates = np.flatnonzero(has_text)
+        sources, targets = [], []
+        for band in range(bands):
+            block = np.ascontiguousarray(signatures[candidates, band * rows:(band + 1) * rows])
+            _, buckets = np.unique(block.view(f'V{block.shape[1] * 4}').ravel(), return_inverse=True)
+            order = np.argsort(buckets, kind='stable')
+            sorted_buckets = buckets[order]
+            first = np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]]
+            leaders = order[first][np.cumsum(first) - 1]
+            members = order[~first]
+            leaders = leaders[~first]
+            if len(members):
+                similarity = (signatures[candidates[members]] == signatures[candidates[leaders]]).mean(axis=1)
+                keep = similarity >= threshold
+                sources.append(candidates[members[keep]])
+                targets.append(candidates[leaders[keep]])
+
+        sources = np.concatenate(sources) if sources else np.array([], dtype=int)
+        targets = np.concatenate(targets) if targets else np.array([], dtype=int)
+        graph = coo_matrix((np.ones(len(sources)), (sources, targets)), shape=(len(df), len(df)))
+        _, labels = connected_components(graph, directed=False)
+
+    # Number clusters by their representative so IDs are stable across runs
+    index = pd.Series(df.index.to_numpy())
+    representative = index.groupby(labels).transform('min').to_numpy()
+    return pd.DataFrame({
+        'dup_cluster': representative,
+        'dup_size': index.groupby(labels).transform('size').to_numpy(),
+        'dup_representative': representative == index.to_numpy()
+    }, index=df.index)
+
+
+def deduplicate(df: pd.DataFrame) -> pd.DataFrame:
+    """Flag near-duplicate profiles, write the cluster report and optionally keep one per cluster."""
+    clusters = duplicate_clusters(df)
+    df = df.join(clusters)
+    duplicated = df[df['dup_size'] > 1]
+
+    columns = ['dup_cluster', 'dup_size', 'dup_representative'] + [c for c in ('source_file', 'title') if c in df]
+    duplicated[columns].sort_values(['dup_size', 'dup_cluster'], ascending=[False, True]).to_csv(
+        config.DEDUP_REPORT_FILE, index_label='freelancer_index'
+    )
+    print(f"🧬 {len(duplicated)} of {len(df)} profiles fall in {duplicated['dup_cluster'].nunique()} "
+          f"near-duplicate clusters (threshold {config.DEDUP_THRESHOLD}), see {config.DEDUP_REPORT_FILE}")
+
+    if config.DEDUP_MODE == 'representative':
+        return df[df['dup_representative']]
+    return df
@@ -0,0 +1,195 @@
+"""Sequential early stopping for adaptive sampling runs."""
+import math
+import random
+import threading
+from statistics import NormalDist
+
+import pandas as pd
+
+import config
+from utils.file_utils import file_exists
+
+
+def to_rate(value):
+    """Convert a recommended rate to float, or None if it is not numeric."""
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(rate) else rate
+
+
+def freelancer_key(row):
+    """Stable freelancer of a prompt row: its freelancer_id, or freelancer_index for legacy rows."""
+    freelancer_id = row.get('freelancer_id')
+    if isinstance(freelancer_id, str) and freelancer_id:
+        return freelancer_id
+    return f"index:{row.get('freelancer_index')}"
+
+
+class SequentialStopper:
+    """Track paired-difference confidence intervals per cell and stop converged cells.
+
+    A cell is (model, prompt variation, counterfactual value). Each freelancer's
+    counterfactual result is paired with its baseline result for the same model
+    and prompt variation. Pipelines without a counterfactual axis pair the
+    recommended rate with ``reference_column`` instead.
+
+    A freelancer adds at most one pair to a cell: each side is the mean of its
+    samples, and when a side changes (more samples, a late baseline) the
+    pair's previous difference is replaced rather than added again.
+    """
+
+    def __init__(self, counterfactual_column=None, baseline_value=None,
+                 variation_column=None, reference_column=None):
+        self.counterfactual_column = counterfactual_column
+        self.baseline_value = baseline_value
+        self.variation_column = variation_column
+        self.reference_column = reference_column
+        self.max_width = config.ADAPTIVE_CI_WIDTH
+        self.min_pairs = config.ADAPTIVE_MIN_PAIRS
+        self.z = NormalDist().inv_cdf(0.5 + config.ADAPTIVE_CONFIDENCE / 2)
+        self.lock = threading.Lock()
+        self.values = []
+        self.pending = {}
+        self.diffs = {}
+        self.cells = {}
+        self.skipped = 0
+        self.enabled = True
+
+    def prepare(self, df: pd.DataFrame, results_file: str) -> pd.DataFrame:
+        """Load prior results and return prompts ordered by shuffled freelancer."""
+        if 'freelancer_id' not in df.columns and 'freelancer_index' not in df.columns:
+            print("⚠️ Prompts file has no freelancer_id column, adaptive sampling disabled")
+            self.enabled = False
+            return df
+
+        if self.counterfactual_column:
+            self.values = [v for v in df[self.counterfactual_column].unique() if v != self.baseline_value]
+
+        if file_exists(results_file):
+            try:
+                for result in pd.read_csv(results_file).to_dict('records'):
+                    if result['row_index'] in df.index:
+                        self.record(df.loc[result['row_index']], [result])
+            except Exception as e:
+                print(f"⚠️ Could not load prior results for adaptive sampling: {e}")
+
+        keys = 'index:' + df['freelancer_index'].astype(str) if 'freelancer_index' in df else pd.Series('index:None', index=df.index)
+        if 'freelancer_id' in df:
+            keys = df['freelancer_id'].where(df['freelancer_id'].notna(), keys)
+        freelancers = sorted(keys.unique())
+        random.Random(config.SAMPLING_SEED).shuffle(freelancers)
+        position = {freelancer: i for i, freelancer in enumerate(freelancers)}
+        order = keys.map(position).sort_values(kind='stable').index
+        return df.loc[order]
+
+    def _cell(self, row, model, value):
+        variation = row[self.variation_column] if self.variation_column else None
+        return (model, variation, value)
+
+    def _add(self, cell, diff):
+        # Welford's online mean/variance update
+        n, mean, m2 = self.cells.get(cell, (0, 0.0, 0.0))
+        n += 1
+        delta = diff - mean
+        mean += delta / n
+        m2 += delta * (diff - mean)
+        self.cells[cell] = (n, mean, m2)
+
+    def _remove(self, cell, diff):
+        # Inverse of _add
+        n, mean, m2 = self.cells[cell]
+        if n == 1:
+            del self.cells[cell]
+            return
+        previous = (n * mean - diff) / (n - 1)
+        self.cells[cell] = (n - 1, previous, m2 - (diff - previous) * (diff - mean))
+
+    def _pair(self, pair_key, cell, diff):
+        """Set the difference a freelancer's pair contributes to a cell."""
+        if (pair_key, cell) in self.diffs:
+            self._remove(cell, self.diffs[(pair_key, cell)])
+        self.diffs[(pair_key, cell)] = diff
+        self._add(cell, diff)
+
+    @staticmethod
+    def _mean(samples: dict) -> float:
+        return sum(samples.values()) / len(samples)
+
+    def width(self, cell) -> float:
+        """Return the confidence interval width of a cell's mean paired difference."""
+        n, _, m2 = self.cells.get(cell, (0, 0.0, 0.0))
+        if n < 2:
+            return math.inf
+        return 2 * self.z * math.sqrt(m2 / (n - 1) / n)
+
+    def converged(self, cell) -> bool:
+        """Check whether a cell has enough pairs and a narrow enough interval."""
+        return self.cells.get(cell, (0,))[0] >= self.min_pairs and self.width(cell) <= self.max_width
+
+    def record(self, row, results: list):
+        """Record completed results for a prompt row."""
+        if not self.enabled:
+            return
+
+        with self.lock:
+            for result in results:
+                rate = to_rate(result.get('recommended_rate'))
+                if result.get('status') != 'success' or rate is None:
+                    continue
+                model = result['model']
+                sample = result.get('sample_index', 0)
+                key = (model, row[self.variation_column] if self.variation_column else None, freelancer_key(row))
+
+                if not self.counterfactual_column:
+                    reference = to_rate(row[self.reference_column])
+                    if reference is not None:
+                        samples = self.pending.setdefault(key, {}).setdefault(None, {})
+                        samples[sample] = rate
+                        self._pair(key, self._cell(row, model, None), self._mean(samples) - reference)
+                    continue
+
+                value = row[self.counterfactual_column]
+                pair = self.pending.setdefault(key, {})
+                pair.setdefault(value, {})[sample] = rate
+
+                if value == self.baseline_value:
+                    baseline = self._mean(pair[value])
+                    for other, samples in pair.items():
+                        if other != self.baseline_value:
+                            self._pair(key, self._cell(row, model, other), self._mean(samples) - baseline)
+                elif self.baseline_value in pair:
+                    self._pair(key, self._cell(row, model, value), self._mean(pair[value]) - self._mean(pair[self.baseline_value]))
+
+    def should_skip(self, row, model) -> bool:
+        """Check whether a task can be skipped because its cell has converged."""
+        if not self.enabled:
+            return False
+
+        with self.lock:
+            if not self.counterfactual_column:
+                skip = self.converged(self._cell(row, model, None))
+            elif row[self.counterfactual_column] == self.baseline_value:
+                # Baseline rows feed every cell of their model and variation
+                skip = bool(self.values) and all(
+                    self.converged(self._cell(row, model, value)) for value in self.values
+                )
+            else:
+                skip = self.converged(self._cell(row, model, row[self.counterfactual_column]))
+
+            if skip:
+                self.skipped += 1
+            return skip
+
+    def summary(self) -> dict:
+        """Return adaptive sampling statistics for print_summary."""
+        converged = [cell for cell in self.cells if self.converged(cell)]
+        widths = [self.width(cell) for cell in self.cells if self.width(cell) < math.inf]
+        return {
+            "Cells tracked": len(self.cells),
+            "Converged cells": len(converged),
+            "Paired observations": sum(stats[0] for stats in self.cells.values()),
+            "Widest CI (USD)": max(widths) if widths else "n/a",
+            "Tasks skipped": self.skipped
+        }
@@ -1,5 +1,10 @@
 import pandas as pd
+import hashlib
 import os
+from collections import Counter
+
+import config
+from utils.profiling import stage
 
 
 def file_exists(filepath: str) -> bool:
@@ -8,20 +13,177 @@ def file_exists(filepath: str) -> bool:
 
 
 def save_to_csv(data: list, filepath: str, append: bool = False):
-    """Save data to CSV file."""
-    df = pd.DataFrame(data)
-    mode = 'a' if append else 'w'
-    header = not (append and file_exists(filepath))
-    df.to_csv(filepath, mode=mode, header=header, index=False)
+    """Save data to CSV file, keeping appended rows aligned with the existing header."""
+    with stage('save_to_csv'):
+        df = pd.DataFrame(data)
+        mode = 'a' if append else 'w'
+        header = not (append and file_exists(filepath))
+        if not header:
+            columns = list(pd.read_csv(filepath, nrows=0).columns)
+            if set(df.columns) - set(columns):
+                # New columns: rewrite the file with existing rows first, so row positions are kept
+                rewrite_csv(pd.concat([pd.read_csv(filepath), df], ignore_index=True), filepath)
+                return
+            else:
+                df = df.reindex(columns=columns)
+        df.to_csv(filepath, mode=mode, header=header, index=False)
 
 
-def load_completed_tasks(filepath: str) -> set:
-    """Load completed (row_index, model) combinations from results file."""
+def prompt_key(prompt: str, freelancer_id=None) -> str:
+    """Content key of a prompt, stable across regeneration and reordering of the prompts file.
+    
+    Prompt rows are keyed on their freelancer_id and text, so two freelancers
+    whose prompts render identically keep a row each; without a freelancer_id
+    (legacy rows, the audit cache) the key is the text alone.
+    """
+    if isinstance(freelancer_id, str) and freelancer_id:
+        prompt = f"{freelancer_id}|{prompt}"
+    return hashlib.md5(prompt.encode()).hexdigest()[:16]
+
+
+def row_prompt_keys(df: pd.DataFrame) -> pd.Series:
+    """prompt_key of each row of a frame with a prompt (and optionally freelancer_id) column."""
+    ids = df['freelancer_id'] if 'freelancer_id' in df else pd.Series(None, index=df.index, dtype=object)
+    return pd.Series([prompt_key(prompt, fid) for prompt, fid in zip(df['prompt'], ids)], index=df.index, dtype=object)
+
+
+def read_key_columns(filepath: str, columns: list) -> pd.DataFrame:
+    return pd.read_csv(filepath, usecols=lambda col: col in ('prompt', 'freelancer_id') or col in columns)
+
+
+def load_prompt_keys(filepath: str) -> pd.Series:
+    """Load the prompt_key of every prompt row, computing it where none is stored."""
+    if not file_exists(filepath):
+        return pd.Series(dtype=object)
+    
+    columns = list(pd.read_csv(filepath, nrows=0).columns)
+    keys = pd.read_csv(filepath, usecols=['prompt_key'])['prompt_key'] if 'prompt_key' in columns else None
+    if keys is None or keys.isna().any():
+        computed = row_prompt_keys(read_key_columns(filepath, []))
+        keys = computed if keys is None else keys.fillna(computed)
+    return keys
+
+
+def keys_outdated(filepath: str) -> bool:
+    """Check whether stored prompt keys predate freelancer_id keying, from the first rows of the file."""
+    head = pd.read_csv(filepath, nrows=100, usecols=lambda col: col in ('prompt', 'freelancer_id', 'prompt_key'))
+    if 'prompt_key' not in head or 'freelancer_id' not in head:
+        return False
+    head = head.dropna(subset=['prompt_key', 'freelancer_id'])
+    return bool((head['prompt_key'] != row_prompt_keys(head)).any())
+
+
+def keep_new_prompts(rows: list, existing: set) -> list:
+    """Key each generated prompt row and keep only those whose prompt is not generated yet.
+    
+    A legacy row keyed by text alone counts as generated for the first
+    freelancer whose prompt has that text.
+    """
+    new_rows = []
+    for row in rows:
+        row['prompt_key'] = prompt_key(row['prompt'], row.get('freelancer_id'))
+        if row['prompt_key'] in existing:
+            continue
+        legacy = prompt_key(row['prompt'])
+        if legacy in existing:
+            existing.discard(legacy)
+            existing.add(row['prompt_key'])
+            continue
+        existing.add(row['prompt_key'])
+        new_rows.append(row)
+    return new_rows
+
+
+def rewrite_csv(df: pd.DataFrame, filepath: str):
+    """Atomically replace a CSV file."""
+    tmp = f"{filepath}.tmp"
+    with open(tmp, 'w', newline='') as f:
+        df.to_csv(f, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filepath)
+
+
+def align_results(prompts_file: str, results_file: str) -> int:
+    """Re-point results at their prompt rows by prompt_key.
+    
+    Fills missing prompt keys in the prompts file, tags results that predate
+    prompt keys with the key of the row they were produced from, and fixes the
+    row_index of results whose prompt has moved. Returns the rows moved.
+    """
+    if not file_exists(prompts_file):
+        return 0
+    
+    columns = list(pd.read_csv(prompts_file, nrows=0).columns)
+    keyed = 'prompt_key' in columns and pd.read_csv(prompts_file, usecols=['prompt_key'])['prompt_key'].notna().all()
+    # Text-only keys from before freelancer_id keying are recomputed once, results follow by row
+    rekeyed = keyed and keys_outdated(prompts_file)
+    keys = row_prompt_keys(read_key_columns(prompts_file, [])) if rekeyed else load_prompt_keys(prompts_file)
+    if not keyed or rekeyed:
+        prompts = pd.read_csv(prompts_file)
+        prompts['prompt_key'] = keys
+        rewrite_csv(prompts, prompts_file)
+    
+    if not file_exists(results_file):
+        return 0
+    
+    stored = pd.read_csv(results_file, usecols=lambda col: col in ('row_index', 'prompt_key'))
+    if 'prompt_key' not in stored:
+        stored['prompt_key'] = None
+    if rekeyed:
+        stored['prompt_key'] = None
+    positions = pd.Series(keys.index, index=keys.values)
+    positions = positions[~positions.index.duplicated()]
+    expected = stored['prompt_key'].map(positions)
+    legacy = stored['prompt_key'].isna() & stored['row_index'].isin(keys.index)
+    # Only rows whose current position holds a different prompt have moved
+    moved = stored['prompt_key'].notna() & expected.notna() & (stored['row_index'].map(keys) != stored['prompt_key'])
+    if not legacy.any() and not moved.any():
+        return 0
+    
+    results = pd.read_csv(results_file)
+    results.loc[legacy, 'prompt_key'] = results.loc[legacy, 'row_index'].map(keys)
+    results.loc[moved, 'row_index'] = expected[moved].astype(int)
+    rewrite_csv(results, results_file)
+    if moved.any() and file_exists(f"{results_file}.retry.json"):
+        # Queued retries refer to old row positions; the queue is reseeded from the results file
+        os.remove(f"{results_file}.retry.json")
+    return int(moved.sum())
+
+
+def load_result_keys(filepath: str, attempts: bool = False) -> set:
+    """Load (row_index, model, sample_index) keys from results file, plus the retry attempt if requested."""
     if not file_exists(filepath):
         return set()
     
     try:
-        df = pd.read_csv(filepath)
-        return {(row['row_index'], row['model']) for _, row in df.iterrows()}
+        df = pd.read_csv(filepath, usecols=lambda col: col in ('row_index', 'model', 'sample_index', 'attempt'))
+        samples = df['sample_index'].fillna(0).astype(int) if 'sample_index' in df else [0] * len(df)
+        if attempts:
+            tries = df['attempt'].fillna(1).astype(int) if 'attempt' in df else [1] * len(df)
+            return set(zip(df['row_index'], df['model'], samples, tries))
+        return set(zip(df['row_index'], df['model'], samples))
     except Exception:
         return set()
+
+
+def load_sample_counts(filepath: str) -> Counter:
+    """Count stored samples per (row_index, model) in results file."""
+    return Counter((row_index, model) for row_index, model, _ in load_result_keys(filepath))
+
+
+def load_completed_tasks(filepath: str) -> set:
+    """Load (row_index, model) combinations with all SAMPLES_PER_TASK samples from results file."""
+    return {task for task, count in load_sample_counts(filepath).items() if count >= config.SAMPLES_PER_TASK}
+
+
+def load_model_status_counts(filepath: str) -> dict:
+    """Count result rows per (model, status) in results file."""
+    if not file_exists(filepath):
+        return {}
+    
+    try:
+        df = pd.read_csv(filepath, usecols=['model', 'status'])
+        return df.groupby(['model', 'status']).size().to_dict()
+    except Exception:
+        return {}
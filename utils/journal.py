@@ -0,0 +1,177 @@
+"""Write-ahead journal that makes in-flight results crash-safe."""
+import json
+import os
+import time
+
+import pandas as pd
+
+import config
+from utils.file_utils import file_exists, load_result_keys, rewrite_csv
+from utils.progress import update_progress
+from utils.profiling import stage
+from utils.response_archive import ResponseArchive
+
+
+def _to_json(value):
+    """JSON fallback for numpy scalars and other non-native values."""
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def _fsync_dir(path: str):
+    """Flush directory metadata so created/removed files survive a crash."""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class ResultJournal:
+    """Append results to a JSONL journal as they complete and compact them into the results CSV.
+
+    Compaction writes ``<journal>.compact`` with the CSV size before appending,
+    so a crash mid-append is rolled back and replayed on the next start.
+    """
+
+    def __init__(self, results_file: str):
+        self.results_file = results_file
+        self.path = f"{results_file}.journal"
+        self.marker = f"{self.path}.compact"
+        self.archive = ResponseArchive(results_file)
+        self.file = None
+        self.pending = 0
+        self.unsynced = 0
+        self.last_sync = self.last_compact = time.monotonic()
+
+    def _read(self) -> list:
+        records = []
+        if not file_exists(self.path):
+            return records
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Torn final write from a crash
+                    break
+        return records
+
+    def recover(self) -> int:
+        """Roll back a torn compaction and replay leftover journal records."""
+        if file_exists(self.marker):
+            with open(self.marker) as f:
+                offset = int(f.read().strip() or 0)
+            if file_exists(self.results_file) and os.path.getsize(self.results_file) > offset:
+                with open(self.results_file, 'r+b') as f:
+                    f.truncate(offset)
+                    os.fsync(f.fileno())
+            os.remove(self.marker)
+
+        records = self._read()
+        if records:
+            stored = load_result_keys(self.results_file, attempts=True)
+            records = [r for r in records
+                       if (r['row_index'], r['model'], r.get('sample_index', 0), r.get('attempt', 1)) not in stored]
+            self._write_csv(records)
+            print(f"♻️ Recovered {len(records)} results from {self.path}")
+
+        self._reset()
+        return len(records)
+
+    def append(self, results: list):
+        """Append completed results, syncing every JOURNAL_GROUP_COMMIT records."""
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        for result in results:
+            self.file.write(json.dumps(result, default=_to_json) + '\n')
+        self.pending += len(results)
+        self.unsynced += len(results)
+
+        if self.unsynced >= config.JOURNAL_GROUP_COMMIT or time.monotonic() - self.last_sync >= 1:
+            self.sync()
+
+    def sync(self):
+        """Flush buffered journal writes, fsyncing if configured."""
+        if self.file is None:
+            return
+        self.file.flush()
+        if config.JOURNAL_FSYNC:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def maybe_compact(self):
+        """Compact once the journal reaches BATCH_SIZE records or JOURNAL_COMPACT_SECONDS."""
+        if self.pending >= config.BATCH_SIZE or (
+            self.pending and time.monotonic() - self.last_compact >= config.JOURNAL_COMPACT_SECONDS
+        ):
+            self.compact()
+
+    def compact(self):
+        """Move journaled results into the results CSV."""
+        self.sync()
+        records = self._read()
+        if records:
+            self._write_csv(records)
+        self._reset()
+
+    def close(self):
+        """Compact remaining results and remove the journal."""
+        self.compact()
+
+    def _write_csv(self, records: list):
+        if not records:
+            return
+        with stage('write_results'):
+            self._append_csv(records)
+
+    def _append_csv(self, records: list):
+        # Archive raw responses first so every response_ref written to the CSV is durable
+        self.archive.append(records)
+        df = pd.DataFrame(records)
+        offset = os.path.getsize(self.results_file) if file_exists(self.results_file) else 0
+
+        if offset:
+            columns = list(pd.read_csv(self.results_file, nrows=0).columns)
+            if set(df.columns) - set(columns):
+                self._rewrite_csv(df)
+                return
+            # Keep appended rows aligned with the existing header
+            df = df.reindex(columns=columns)
+
+        with open(self.marker, 'w') as f:
+            f.write(str(offset))
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_dir(self.marker)
+
+        header = offset == 0
+        with open(self.results_file, 'a', newline='') as f:
+            df.to_csv(f, header=header, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.remove(self.marker)
+        _fsync_dir(self.marker)
+        update_progress(self.results_file, records)
+
+    def _rewrite_csv(self, df: pd.DataFrame):
+        """Atomically rewrite the results file when new columns appear."""
+        rewrite_csv(pd.concat([pd.read_csv(self.results_file), df], ignore_index=True), self.results_file)
+        _fsync_dir(self.results_file)
+        update_progress(self.results_file, df.to_dict('records'))
+
+    def _reset(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if file_exists(self.path):
+            os.remove(self.path)
+            _fsync_dir(self.path)
+        self.pending = self.unsynced = 0
+        self.last_compact = time.monotonic()
@@ -0,0 +1,175 @@
+"""Bulk mining of reasoning and response text for demographic mentions."""
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import config
+from utils.progress import print_summary
+from utils.response_archive import ResponseArchive, record_content
+
+KEY_COLUMNS = ['row_index', 'model', 'sample_index']
+
+_matcher = None
+
+
+def trie_pattern(terms: list) -> str:
+    """Regex alternation of the terms folded into a prefix trie, so matching never backtracks across terms."""
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        return f"(?:{body})?" if '' in node else body
+
+    return build(trie)
+
+
+def build_matcher(terms: dict, exclude: list = ()) -> tuple:
+    """Whole-word pattern over every term, plus the terms and their (terms x categories) mask.
+
+    A term's mask also covers the categories of shorter terms it contains,
+    so "developing country" counts for both cost of living and country
+    although the scan reports only the longest match at each position.
+    Excluded phrases are matched like terms but flag no category.
+    """
+    categories = [category for category, words in terms.items() if words]
+    excluded = {phrase.lower() for phrase in exclude}
+    words = sorted({word.lower() for category in categories for word in terms[category]} | excluded)
+    contains = {word: re.compile(rf"(?<!\w){re.escape(word)}(?!\w)") for word in words}
+
+    masks = np.zeros((len(words), len(categories)), dtype=bool)
+    for i, word in enumerate(words):
+        for j, category in enumerate(categories):
+            masks[i, j] = word not in excluded and any(contains[term.lower()].search(word) for term in terms[category])
+    return re.compile(rf"(?<!\w){trie_pattern(words)}(?!\w)"), pd.Index(words), masks
+
+
+def scan_texts(texts: pd.Series) -> np.ndarray:
+    """Boolean (rows x categories) matrix of categories mentioned in each text.
+
+    The chunk is joined into one string and scanned once for all terms;
+    match offsets are mapped back to rows, so the Python-level cost grows
+    with the number of mentions rather than the number of rows.
+    """
+    global _matcher
+    if _matcher is None:
+        _matcher = build_matcher(config.MENTION_TERMS, config.MENTION_EXCLUDE)
+    pattern, words, masks = _matcher
+
+    texts = texts.fillna('').astype(str).str.lower()
+    starts = np.concatenate([[0], np.cumsum(texts.str.len().to_numpy() + 1)[:-1]])
+    positions, found = [], []
+    for match in pattern.finditer('\n'.join(texts)):
+        positions.append(match.start())
+        found.append(match.group())
+
+    flags = np.zeros((len(texts), masks.shape[1]), dtype=bool)
+    if positions:
+        rows = np.searchsorted(starts, positions, side='right') - 1
+        np.logical_or.at(flags, rows, masks[words.get_indexer(found)])
+    return flags
+
+
+def archived_responses(chunk: pd.DataFrame, results_file: str) -> pd.Series:
+    """Response text of the chunk, read from the response archive where rows only keep a response_ref."""
+    responses = chunk['response'].astype(object) if 'response' in chunk else pd.Series(None, index=chunk.index, dtype=object)
+    if 'response_ref' not in chunk:
+        return responses
+    refs = chunk['response_ref'].where(responses.isna()).dropna()
+    if refs.empty:
+        return responses
+    archive = ResponseArchive(results_file)
+    contents = {ref: record_content(record) for ref, record in archive.iter_frames(refs.unique())}
+    responses.loc[refs.index] = refs.map(contents)
+    return responses
+
+
+def scan_chunk(chunk: pd.DataFrame, results_file: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Per-row mention flags and per-group (rows, mentions, non-empty fields) counts for one chunk of results."""
+    categories = [category for category, words in config.MENTION_TERMS.items() if words]
+    if 'response' in config.MENTION_FIELDS:
+        chunk = chunk.assign(response=archived_responses(chunk, results_file))
+    fields = [field for field in config.MENTION_FIELDS if field in chunk]
+    columns = [chunk[field].fillna('').astype(str) for field in fields] or [pd.Series('', index=chunk.index)]
+    text = columns[0].str.cat(columns[1:], sep='\n') if len(columns) > 1 else columns[0]
+
+    flags = pd.DataFrame(scan_texts(text).astype(np.uint8), index=chunk.index,
+                         columns=[f'mentions_{category}' for category in categories])
+    flags['mentions_any'] = flags.max(axis=1) if categories else 0
+
+    rows = pd.concat([chunk[[c for c in KEY_COLUMNS if c in chunk]], flags], axis=1)
+    groups = ['model'] + [c for c in config.VARIATION_COLUMNS if c in chunk]
+    filled = pd.DataFrame({f'filled_{field}': (column != '').astype(np.int64) for field, column in zip(fields, columns)},
+                          index=chunk.index)
+    counts = pd.concat([chunk[groups], flags, filled], axis=1).assign(rows=1).groupby(groups, dropna=False).sum()
+    return rows, counts
+
+
+def mine_mentions(results_file: str, workers: int = None) -> pd.DataFrame:
+    """Flag demographic mentions in every result row and aggregate mention rates.
+
+    Chunks of MENTION_CHUNK_SIZE rows are scanned in worker processes, with
+    archived responses read back through their response_ref; flags
+    are streamed to ``<results file>.mentions.csv`` in file order and rates
+    per model, prompt variation and counterfactual value are written to
+    ``<results file>.mention_rates.csv`` and returned.
+    """
+    workers = workers or config.MENTION_WORKERS or os.cpu_count() or 1
+    wanted = set(KEY_COLUMNS + config.VARIATION_COLUMNS + config.MENTION_FIELDS + ['response_ref'])
+    reader = pd.read_csv(results_file, usecols=lambda col: col in wanted, chunksize=config.MENTION_CHUNK_SIZE,
+                         dtype={field: str for field in config.MENTION_FIELDS})
+
+    rows_path = f"{results_file}.mentions.csv"
+    totals = []
+    first = True
+    with ProcessPoolExecutor(max_workers=workers) as executor, open(rows_path, 'w', newline='') as out:
+        pending = deque()
+
+        def collect():
+            nonlocal first
+            rows, counts = pending.popleft().result()
+            rows.to_csv(out, index=False, header=first)
+            first = False
+            totals.append(counts)
+
+        for chunk in reader:
+            pending.append(executor.submit(scan_chunk, chunk, results_file))
+            if len(pending) > workers:
+                collect()
+        while pending:
+            collect()
+
+    if not totals:
+        return pd.DataFrame()
+    counts = pd.concat(totals)
+    counts = counts.groupby(level=list(range(counts.index.nlevels)), dropna=False).sum()
+    total = int(counts['rows'].sum())
+    for field in config.MENTION_FIELDS:
+        filled = int(counts[f'filled_{field}'].sum()) if f'filled_{field}' in counts else 0
+        if filled == 0:
+            print(f"⚠️ '{field}' is empty in all {total:,} rows; mention rates do not cover it")
+        elif filled < total:
+            print(f"⚠️ '{field}' is empty in {total - filled:,} of {total:,} rows")
+    counts = counts.drop(columns=[c for c in counts if c.startswith('filled_')])
+    rates = counts[[c for c in counts if c.startswith('mentions_')]].div(counts['rows'], axis=0).round(4)
+    rates.columns = [c.replace('mentions_', '') + '_rate' for c in rates]
+    rates = pd.concat([counts['rows'], rates], axis=1).reset_index()
+    rates.to_csv(f"{results_file}.mention_rates.csv", index=False)
+
+    per_model = counts.groupby(level='model').sum()
+    print_summary(f"MENTION RATES ({total:,} rows, {workers} workers)", {
+        model: ', '.join(f"{c.replace('mentions_', '')} {row[c] / row['rows']:.1%}" for c in per_model if c.startswith('mentions_'))
+        for model, row in per_model.iterrows()
+    })
+    return rates
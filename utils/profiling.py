@@ -0,0 +1,147 @@
+"""Opt-in per-stage timers and sampling profiler, enabled with config.PROFILE."""
+import atexit
+import csv
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+
+import config
+from utils.progress import print_summary
+
+_NULL_STAGE = nullcontext()
+_stages = {}
+_stages_lock = threading.Lock()
+_local = threading.local()
+_session = None
+
+
+class Stage:
+    """Context manager adding its wall time to a named stage.
+
+    Nested stages are subtracted from their parent's self time, so self times
+    add up to the time spent in instrumented code across all threads.
+    """
+
+    __slots__ = ('name', 'start', 'child')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self)
+        self.child = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        stack.pop()
+        if stack:
+            stack[-1].child += elapsed
+        with _stages_lock:
+            counts = _stages.setdefault(self.name, [0, 0.0, 0.0])
+            counts[0] += 1
+            counts[1] += elapsed
+            counts[2] += elapsed - self.child
+        return False
+
+
+def stage(name: str):
+    """Time a block as ``name`` when profiling is on; a shared no-op otherwise."""
+    if not config.PROFILE:
+        return _NULL_STAGE
+    if _session is None:
+        start()
+    return Stage(name)
+
+
+def frame_label(frame) -> str:
+    """Flame-graph frame label: function (file:line)."""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler(threading.Thread):
+    """Samples every thread's stack at a fixed interval into collapsed stacks."""
+
+    def __init__(self, interval: float):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopping = threading.Event()
+
+    def run(self):
+        names = {}
+        while not self.stopping.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(frame_label(frame))
+                    frame = frame.f_back
+                labels.append(names.get(ident, str(ident)).split('_')[0])
+                self.stacks[';'.join(reversed(labels))] += 1
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+def start():
+    """Start a profiling session and report it at interpreter exit."""
+    global _session
+    if _session is not None:
+        return
+    sampler = StackSampler(config.PROFILE_INTERVAL) if config.PROFILE_SAMPLER else None
+    _session = {'started': time.perf_counter(), 'sampler': sampler}
+    if sampler:
+        sampler.start()
+    atexit.register(report)
+
+
+def stage_rows() -> list:
+    """Per-stage rows sorted by self time."""
+    with _stages_lock:
+        items = sorted(_stages.items(), key=lambda item: -item[1][2])
+    return [{'stage': name, 'calls': calls, 'total_s': round(total, 3), 'self_s': round(own, 3),
+             'mean_ms': round(total / calls * 1000, 3)} for name, (calls, total, own) in items]
+
+
+def report():
+    """Write the stage table and collapsed stacks, and print the stage summary."""
+    global _session
+    if _session is None:
+        return
+    wall = time.perf_counter() - _session['started']
+    sampler = _session['sampler']
+    _session = None
+
+    rows = stage_rows()
+    with open(f"{config.PROFILE_OUTPUT}_stages.csv", 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['stage', 'calls', 'total_s', 'self_s', 'mean_ms'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+    summary = {"Wall time (s)": round(wall, 1)}
+    for row in rows:
+        summary[row['stage']] = (f"{row['self_s']:.2f}s self, {row['total_s']:.2f}s total, "
+                                 f"{row['calls']:,} calls, {row['mean_ms']:.2f} ms/call")
+
+    if sampler:
+        sampler.stop()
+        with open(f"{config.PROFILE_OUTPUT}.folded", 'w') as f:
+            for stack, count in sampler.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        summary["Stack samples"] = f"{sum(sampler.stacks.values()):,} in {config.PROFILE_OUTPUT}.folded"
+
+    print_summary("PROFILE SUMMARY (thread-seconds per stage)", summary)
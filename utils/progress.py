@@ -1,3 +1,5 @@
+import json
+import os
 import time
 
 def print_progress(completed: int, total: int, success: int, failed: int):
@@ -17,3 +19,49 @@ def print_summary(title: str, data: dict):
         else:
             print(f"{key}: {value}")
     print('='*60)
+
+
+def progress_path(results_file: str) -> str:
+    """Path of the lightweight progress metadata kept next to a results file."""
+    return f"{results_file}.progress.json"
+
+
+def load_progress(results_file: str) -> dict:
+    """Load progress metadata, or an empty record if none exists."""
+    try:
+        with open(progress_path(results_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_progress(results_file: str, progress: dict):
+    """Atomically write progress metadata."""
+    progress['updated'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    path = progress_path(results_file)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(progress, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def rebuild_progress(results_file: str, model_status_counts: dict):
+    """Reset per-model counts from {(model, status): rows} counted over the results file."""
+    progress = load_progress(results_file)
+    progress['models'] = {}
+    for (model, status), count in model_status_counts.items():
+        counts = progress['models'].setdefault(model, {'success': 0, 'failed': 0})
+        counts['success' if status == 'success' else 'failed'] += int(count)
+    save_progress(results_file, progress)
+
+
+def update_progress(results_file: str, results: list = (), **fields):
+    """Add newly stored results to existing progress metadata and set extra fields."""
+    if not os.path.exists(progress_path(results_file)):
+        return
+    progress = load_progress(results_file)
+    models = progress.setdefault('models', {})
+    for result in results:
+        counts = models.setdefault(result['model'], {'success': 0, 'failed': 0})
+        counts['success' if result['status'] == 'success' else 'failed'] += 1
+    progress.update(fields)
+    save_progress(results_file, progress)
@@ -0,0 +1,125 @@
+"""Append-only, zstd-compressed archive of raw API responses."""
+import json
+import os
+
+import pandas as pd
+import zstandard as zstd
+
+import config
+from utils.file_utils import file_exists
+from services.batch import task_id
+from services.openrouter import parse_response
+
+
+def parse_ref(ref: str) -> tuple[int, int, int]:
+    """Decode a response_ref into (frame offset, frame size, line in frame)."""
+    offset, size, line = ref.split(':')
+    return int(offset), int(size), int(line)
+
+
+def record_content(record: dict):
+    """Message content of the choice an archived record belongs to."""
+    return record['response']['choices'][record['choice']]['message']['content']
+
+
+class ResponseArchive:
+    """Raw responses stored as independent zstd frames in ``<results file>.archive.zst``.
+
+    Each compaction writes one frame, so any record can be read by decompressing
+    a single frame. Result rows keep a ``response_ref`` (frame offset, frame
+    size, line) and ``<results file>.archive.idx`` maps task IDs to the same
+    pointers for lookups without the results file.
+    """
+
+    def __init__(self, results_file: str):
+        self.path = f"{results_file}.archive.zst"
+        self.index_path = f"{results_file}.archive.idx"
+
+    def append(self, records: list):
+        """Archive records carrying a ``raw`` response, replacing their text with a response_ref."""
+        archived = [record for record in records if record.get('raw')]
+        if not archived:
+            return
+
+        ids = [task_id(r['row_index'], r['model'], r.get('sample_index', 0)) for r in archived]
+        lines = []
+        for tid, record in zip(ids, archived):
+            raw = record.pop('raw')
+            lines.append(json.dumps({'task_id': tid, 'attempt': record.get('attempt', 1),
+                                     'status': record['status'], **raw}))
+        frame = zstd.ZstdCompressor(level=config.ARCHIVE_LEVEL).compress('\n'.join(lines).encode())
+
+        with open(self.path, 'ab') as f:
+            offset = f.tell()
+            f.write(frame)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(self.index_path, 'a') as f:
+            for line, tid in enumerate(ids):
+                f.write(f"{tid},{offset},{len(frame)},{line}\n")
+
+        for line, record in enumerate(archived):
+            record['response_ref'] = f"{offset}:{len(frame)}:{line}"
+            record['response'] = None
+
+    def read_frame(self, offset: int, size: int) -> list:
+        """Decompress one frame into its records."""
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = zstd.ZstdDecompressor().decompress(f.read(size))
+        return [json.loads(line) for line in data.decode().split('\n')]
+
+    def get(self, ref: str) -> dict:
+        """Read the archived record a result row's response_ref points to."""
+        offset, size, line = parse_ref(ref)
+        return self.read_frame(offset, size)[line]
+
+    def load_index(self) -> dict:
+        """Map task ID -> latest response_ref."""
+        if not file_exists(self.index_path):
+            return {}
+        index = {}
+        with open(self.index_path) as f:
+            for entry in f:
+                tid, _, ref = entry.rstrip('\n').partition(',')
+                if ref.count(',') == 2:
+                    index[tid] = ref.replace(',', ':')
+        return index
+
+    def lookup(self, row_index: int, model: str, sample_index: int = 0):
+        """Read the latest archived record for a task, or None."""
+        ref = self.load_index().get(task_id(row_index, model, sample_index))
+        return self.get(ref) if ref else None
+
+    def iter_frames(self, refs):
+        """Yield (ref, record) for the given refs, decompressing each frame once."""
+        frames = {}
+        for ref in refs:
+            offset, size, line = parse_ref(ref)
+            frames.setdefault((offset, size), []).append((line, ref))
+        for (offset, size), lines in sorted(frames.items()):
+            records = self.read_frame(offset, size)
+            for line, ref in lines:
+                yield ref, records[line]
+
+
+def reparse_results(results_file: str, parser=parse_response) -> int:
+    """Re-run response parsing over archived responses and rewrite rate/reasoning columns."""
+    df = pd.read_csv(results_file)
+    if 'response_ref' not in df:
+        return 0
+
+    archive = ResponseArchive(results_file)
+    refs = df['response_ref'].dropna()
+    parsed = {ref: parser(record_content(record)) for ref, record in archive.iter_frames(refs.unique())}
+
+    df.loc[refs.index, 'recommended_rate'] = [parsed[ref][0] for ref in refs]
+    df.loc[refs.index, 'reasoning'] = [parsed[ref][1] for ref in refs]
+
+    tmp = f"{results_file}.tmp"
+    with open(tmp, 'w', newline='') as f:
+        df.to_csv(f, index=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, results_file)
+    return len(refs)
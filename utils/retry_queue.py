@@ -0,0 +1,150 @@
+"""Deferred retry queue for samples that failed with transient errors."""
+import json
+import os
+import time
+
+import pandas as pd
+
+import config
+from utils.file_utils import file_exists, load_model_status_counts
+from utils.progress import rebuild_progress
+from services.openrouter import failure_class
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds to wait before the next retry after the given number of attempts."""
+    return min(config.RETRY_BASE_DELAY * 2 ** (attempts - 1), config.RETRY_MAX_DELAY)
+
+
+def read_attempts(results_file: str) -> pd.DataFrame:
+    """Read (row_index, model, sample_index, status, attempt) for every result row."""
+    df = pd.read_csv(results_file, usecols=lambda col: col in ('row_index', 'model', 'sample_index', 'status', 'attempt'))
+    df['sample_index'] = df['sample_index'].fillna(0).astype(int) if 'sample_index' in df else 0
+    df['attempt'] = df['attempt'].fillna(1).astype(int) if 'attempt' in df else 1
+    return df
+
+
+class RetryQueue:
+    """Transiently failed samples waiting for another attempt.
+
+    Entries live in ``<results file>.retry.json`` and are also seeded from
+    failure rows in the results file, so failures recorded before the queue
+    existed are retried too. A sample is given up on after RETRY_MAX_ATTEMPTS
+    transient failures; 4xx errors are never queued.
+    """
+
+    def __init__(self, results_file: str):
+        self.results_file = results_file
+        self.path = f"{results_file}.retry.json"
+        self.entries = {}
+        self.retried = 0
+        self.resolved = 0
+
+    def load(self):
+        """Load saved entries and reconcile them with the results file."""
+        if file_exists(self.path):
+            with open(self.path) as f:
+                for entry in json.load(f):
+                    self.entries[(entry['row_index'], entry['model'], entry['sample_index'])] = entry
+
+        if not file_exists(self.results_file):
+            return self
+
+        df = read_attempts(self.results_file)
+        classes = {status: failure_class(status) for status in df['status'].unique()}
+        df['settled'] = df['status'].map(classes) != 'transient'
+        grouped = df.groupby(['row_index', 'model', 'sample_index']).agg(
+            settled=('settled', 'any'), attempts=('attempt', 'max'), status=('status', 'last')
+        )
+
+        unsettled = grouped[~grouped['settled']]
+        if self.entries:
+            known = pd.MultiIndex.from_tuples(list(self.entries), names=grouped.index.names)
+            for key in known[known.isin(grouped.index[grouped['settled']])]:
+                self.entries.pop(key, None)
+            unsettled = unsettled[~unsettled.index.isin(known)]
+
+        for key, attempts, status in zip(unsettled.index, unsettled['attempts'], unsettled['status']):
+            self.entries[key] = {
+                'row_index': int(key[0]), 'model': key[1], 'sample_index': int(key[2]),
+                'attempts': int(attempts), 'status': status, 'next_at': 0,
+                'gave_up': int(attempts) >= config.RETRY_MAX_ATTEMPTS
+            }
+        return self
+
+    def save(self):
+        """Atomically persist the queue."""
+        if not self.entries and not file_exists(self.path):
+            return
+        with open(f"{self.path}.tmp", 'w') as f:
+            json.dump(list(self.entries.values()), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def record(self, result: dict):
+        """Queue a transient failure for a later attempt, or drop a sample that settled."""
+        key = (result['row_index'], result['model'], result.get('sample_index', 0))
+        attempts = result.get('attempt', 1)
+        if attempts > 1:
+            self.retried += 1
+
+        if failure_class(result['status']) != 'transient':
+            if self.entries.pop(key, None):
+                self.resolved += 1
+            return
+
+        self.entries[key] = {
+            'row_index': int(key[0]), 'model': key[1], 'sample_index': int(key[2]),
+            'attempts': attempts, 'status': result['status'],
+            'next_at': time.time() + retry_delay(attempts),
+            'gave_up': attempts >= config.RETRY_MAX_ATTEMPTS
+        }
+
+    def pending(self) -> list:
+        """Entries still to be retried."""
+        return [entry for entry in self.entries.values() if not entry['gave_up']]
+
+    def due(self, models: list) -> list:
+        """Pending entries for the given models whose delay has passed."""
+        now = time.time()
+        return [entry for entry in self.pending() if entry['model'] in models and entry['next_at'] <= now]
+
+    def next_due(self, models: list):
+        """Time of the earliest pending retry for the given models, or None."""
+        times = [entry['next_at'] for entry in self.pending() if entry['model'] in models]
+        return min(times) if times else None
+
+    def compact(self):
+        """Drop failure rows superseded by a later attempt from the results file."""
+        if not self.retried or not file_exists(self.results_file):
+            return 0
+
+        keys = read_attempts(self.results_file)
+        superseded = keys.duplicated(['row_index', 'model', 'sample_index'], keep='last').to_numpy()
+        if not superseded.any():
+            return 0
+
+        # Stream the file as text so kept rows are written back unchanged
+        tmp = f"{self.results_file}.tmp"
+        with open(tmp, 'w', newline='') as f:
+            header = True
+            for chunk in pd.read_csv(self.results_file, dtype=str, keep_default_na=False,
+                                     chunksize=config.RESULTS_CHUNK_SIZE):
+                chunk[~superseded[chunk.index]].to_csv(f, index=False, header=header)
+                header = False
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.results_file)
+        rebuild_progress(self.results_file, load_model_status_counts(self.results_file))
+        return int(superseded.sum())
+
+    def summary(self) -> dict:
+        """Counts for the run summary."""
+        gave_up = len([entry for entry in self.entries.values() if entry['gave_up']])
+        return {
+            "Retried samples": self.retried,
+            "Settled by retry": self.resolved,
+            "Still queued": len(self.entries) - gave_up,
+            "Given up": gave_up
+        }
@@ -0,0 +1,469 @@
+import os
+import pickle
+import signal
+import tempfile
+import threading
+import time
+from itertools import islice, zip_longest
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import config
+from utils.file_utils import load_sample_counts, load_model_status_counts, align_results
+from utils.journal import ResultJournal
+from utils.retry_queue import RetryQueue
+from utils.profiling import stage
+from utils.progress import print_progress, print_summary, rebuild_progress, update_progress, load_progress
+from services.openrouter import (
+    call_api_samples, hedge_stats, latency_percentile, ModelUnavailable, get_breaker, breaker_states, get_key_pool,
+    n_shortfalls
+)
+
+
+def install_drain_handlers(stopping: threading.Event) -> dict:
+    """Make SIGINT/SIGTERM request a graceful drain; a second signal aborts."""
+    if threading.current_thread() is not threading.main_thread():
+        return {}
+
+    def handler(signum, frame):
+        if stopping.is_set():
+            raise KeyboardInterrupt
+        print(f"\n🛑 Received signal {signum}, draining in-flight tasks (repeat to abort)...")
+        stopping.set()
+
+    previous = {}
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        previous[signum] = signal.signal(signum, handler)
+    return previous
+
+
+def sync_models() -> list:
+    """Models queried through the synchronous API; batch-capable models are left to batch mode."""
+    if config.BATCH_MODE:
+        return [m for m in config.MODELS if m not in config.BATCH_MODELS]
+    return list(config.MODELS)
+
+
+def process_row(row_data, sample_counts, stopper, result_fields, models):
+    """Process a single row with the given models, collecting any missing samples.
+
+    Returns the results and the models whose circuit breaker is open, so the
+    runner can park those tasks instead of recording failures.
+    """
+    idx, row = row_data
+    results = []
+    parked = []
+
+    for model in models:
+        stored = sample_counts.get((idx, model), 0)
+        if stored >= config.SAMPLES_PER_TASK:
+            continue
+        if stopper and stopper.should_skip(row, model):
+            continue
+
+        try:
+            samples = call_api_samples(row['prompt'], model, idx, config.SAMPLES_PER_TASK - stored, stored)
+        except ModelUnavailable as e:
+            samples = getattr(e, 'results', [])
+            parked.append(model)
+
+        for result in samples:
+            result.update(result_fields(row))
+            results.append(result)
+
+    return results, parked
+
+
+def process_retry_row(row_data, samples, result_fields):
+    """Retry queued (model, sample_index, attempt) samples of a single row."""
+    idx, row = row_data
+    results = []
+
+    for model, sample_index, attempt in samples:
+        try:
+            result = call_api_samples(row['prompt'], model, idx, 1, sample_index)[0]
+        except ModelUnavailable:
+            # Stays queued until the model's breaker closes
+            continue
+        result['attempt'] = attempt
+        result.update(result_fields(row))
+        results.append(result)
+
+    return results, []
+
+
+def wait_for_parked(parked: dict, stopping: threading.Event) -> bool:
+    """Wait until a parked model can be probed; False if every parked model gave up."""
+    models = {model for task_models in parked.values() for model in task_models}
+    while not stopping.is_set():
+        breakers = [get_breaker(model) for model in models]
+        if any(breaker.available() for breaker in breakers):
+            return True
+        if all(breaker.exhausted() for breaker in breakers):
+            return False
+        time.sleep(1)
+    return False
+
+
+def iter_prompt_rows(prompts_file: str):
+    """Yield (row_index, row) pairs from the prompts file in bounded-size chunks."""
+    reader = pd.read_csv(prompts_file, chunksize=config.PROMPT_CHUNK_SIZE)
+    while True:
+        with stage('read_prompts'):
+            chunk = next(reader, None)
+            if chunk is None:
+                return
+            records = chunk.to_dict('records')
+        yield from zip(chunk.index, records)
+
+
+def iter_pending_tasks(rows, completed_tasks: set, models: list, stats: dict):
+    """Yield (task, models) for prompt rows that still have models to run, counting all rows in stats."""
+    for idx, row in rows:
+        stats['prompts'] += 1
+        pending = [m for m in models if (idx, m) not in completed_tasks]
+        if pending:
+            yield (idx, row), pending
+
+
+def model_weights(results_file: str, models: list) -> dict:
+    """Median latency per model from this run, else from the last run, else the mean of known models."""
+    saved = load_progress(results_file).get('latency', {})
+    known = {model: latency_percentile(model, 50) or saved.get(model) for model in models}
+    observed = [latency for latency in known.values() if latency]
+    default = sum(observed) / len(observed) if observed else 1.0
+    return {model: known[model] or default for model in models}
+
+
+def order_by_cost(tasks, results_file: str, models: list):
+    """Reorder pending tasks chunk by chunk by estimated cost (prompt length x model latency).
+
+    ``longest_first`` dispatches the most expensive tasks first so the end of
+    each chunk, and of the run, is made of short tasks. ``balanced`` splits the
+    chunk into LENGTH_BUCKETS cost buckets and interleaves them so the window
+    always holds a mix of long and short tasks.
+    """
+    while True:
+        chunk = list(islice(tasks, config.PROMPT_CHUNK_SIZE))
+        if not chunk:
+            return
+        weights = model_weights(results_file, models)
+        costs = [len(str(row['prompt'])) * sum(weights[m] for m in task_models) for (_, row), task_models in chunk]
+        order = sorted(range(len(chunk)), key=lambda i: -costs[i])
+
+        if config.TASK_ORDER == 'balanced':
+            size = -(-len(order) // config.LENGTH_BUCKETS)
+            buckets = [order[start:start + size] for start in range(0, len(order), size)]
+            order = [i for group in zip_longest(*buckets) for i in group if i is not None]
+
+        yield from (chunk[i] for i in order)
+
+
+def coverage_order(prompts_file: str, completed_tasks: set, models: list, stats: dict) -> tuple[np.ndarray, int, int]:
+    """Row indices of pending prompt rows in coverage order, from the stratum columns only."""
+    wanted = {'freelancer_id', 'freelancer_index', 'source_file', *config.VARIATION_COLUMNS}
+    frames = []
+    for chunk in pd.read_csv(prompts_file, usecols=lambda c: c in wanted, dtype=str, chunksize=config.PROMPT_CHUNK_SIZE):
+        stats['prompts'] += len(chunk)
+        pending = [any((idx, m) not in completed_tasks for m in models) for idx in chunk.index]
+        frames.append(chunk[pending])
+    rows = pd.concat(frames) if frames else pd.DataFrame()
+    if rows.empty:
+        return np.array([], dtype=np.int64), 0, 0
+
+    positions = rows.index.to_numpy()
+    groups = pd.Series('row:' + rows.index.astype(str), index=rows.index)
+    if 'freelancer_index' in rows:
+        groups = ('index:' + rows['freelancer_index']).fillna(groups)
+    if 'freelancer_id' in rows:
+        groups = rows['freelancer_id'].fillna(groups)
+    sources = rows['source_file'].fillna('') if 'source_file' in rows else pd.Series('', index=rows.index)
+
+    # Round-robin turn of each freelancer: its position among the shuffled freelancers of its source file
+    freelancers = pd.DataFrame({'group': groups, 'source': sources}).drop_duplicates('group')
+    rng = np.random.default_rng(config.SAMPLING_SEED)
+    freelancers = freelancers.iloc[rng.permutation(len(freelancers))]
+    turn = freelancers.groupby('source', sort=False).cumcount()
+    turns = groups.map(pd.Series(turn.to_numpy(), index=freelancers['group'])).to_numpy()
+    source_codes = pd.factorize(sources)[0]
+    group_codes = groups.map(pd.Series(np.arange(len(freelancers)), index=freelancers['group'])).to_numpy()
+
+    # Siblings in round-robin order over variation columns (first column varies slowest)
+    siblings = [pd.factorize(rows[column])[0] for column in config.VARIATION_COLUMNS if column in rows]
+    order = np.lexsort([positions, *reversed(siblings), group_codes, source_codes, turns])
+    return positions[order], len(freelancers), len(set(source_codes))
+
+
+def order_by_coverage(prompts_file: str, completed_tasks: set, models: list, stats: dict):
+    """Yield pending tasks so any prefix of the run covers every stratum evenly.
+
+    Tasks are grouped by freelancer (``freelancer_id``) so all counterfactual
+    siblings are dispatched together. Groups are shuffled within their source
+    file and taken round-robin across source files, and within a group the
+    siblings are interleaved across prompt variations and counterfactual
+    values. Models of a task are always dispatched together.
+
+    The order is computed from the stratum columns alone. Prompt rows are
+    then streamed once and spilled to temporary files in blocks of
+    PROMPT_CHUNK_SIZE consecutive positions of that order, and the blocks are
+    read back one at a time, so only a block of prompts is held in memory.
+    """
+    order, n_freelancers, n_sources = coverage_order(prompts_file, completed_tasks, models, stats)
+    if not len(order):
+        return
+    print(f"🧭 Coverage order: {len(order):,} tasks from {n_freelancers:,} freelancers across {n_sources} source files")
+
+    rank = pd.Series(np.arange(len(order)), index=order)
+    n_blocks = -(-len(order) // config.PROMPT_CHUNK_SIZE)
+    with tempfile.TemporaryDirectory(prefix='coverage-') as spill:
+        buffered, count = {}, 0
+
+        def flush():
+            for block, records in buffered.items():
+                with open(os.path.join(spill, f"{block}.pkl"), 'ab') as f:
+                    pickle.dump(records, f)
+            buffered.clear()
+
+        for idx, row in iter_prompt_rows(prompts_file):
+            position = rank.get(idx)
+            if position is None:
+                continue
+            buffered.setdefault(position // config.PROMPT_CHUNK_SIZE, []).append((position, idx, row))
+            count += 1
+            if count % config.PROMPT_CHUNK_SIZE == 0:
+                flush()
+        flush()
+
+        for block in range(n_blocks):
+            path = os.path.join(spill, f"{block}.pkl")
+            if not os.path.exists(path):
+                continue
+            records = []
+            with open(path, 'rb') as f:
+                while True:
+                    try:
+                        records.extend(pickle.load(f))
+                    except EOFError:
+                        break
+            os.remove(path)
+            for _, idx, row in sorted(records, key=lambda record: record[0]):
+                yield (idx, row), [m for m in models if (idx, m) not in completed_tasks]
+
+
+def save_latencies(results_file: str, models: list):
+    """Keep each model's median latency in the progress file for the next run's ordering."""
+    latency = load_progress(results_file).get('latency', {})
+    for model in models:
+        median = latency_percentile(model, 50)
+        if median:
+            latency[model] = round(median, 3)
+    update_progress(results_file, latency=latency)
+
+
+def iter_parked_tasks(prompts_file: str, parked: dict):
+    """Yield (task, models) for parked tasks with a second pass over the prompts file."""
+    for idx, row in iter_prompt_rows(prompts_file):
+        if idx in parked:
+            yield (idx, row), parked[idx]
+
+
+def iter_retry_tasks(prompts_file: str, entries: list):
+    """Yield (task, samples) for due retry queue entries with a pass over the prompts file."""
+    samples = {}
+    for entry in entries:
+        samples.setdefault(entry['row_index'], []).append((entry['model'], entry['sample_index'], entry['attempts'] + 1))
+    for idx, row in iter_prompt_rows(prompts_file):
+        if idx in samples:
+            yield (idx, row), samples[idx]
+
+
+def wait_for_retries(queue: RetryQueue, models: list, max_wait: float, stopping: threading.Event) -> bool:
+    """Wait for the next queued retry to come due; False if none is due within max_wait."""
+    next_at = queue.next_due(models)
+    if next_at is None or next_at - time.time() > max_wait:
+        return False
+    # Sleep at least a second so retries held by an open breaker don't spin
+    next_at = max(next_at, time.time() + 1)
+    while not stopping.is_set() and time.time() < next_at:
+        time.sleep(min(1, max(next_at - time.time(), 0)))
+    return not stopping.is_set()
+
+
+def run_api_processing(prompts_file: str, results_file: str, result_fields, stopper=None, retry_only=False):
+    """Run API processing with a bounded window of in-flight tasks.
+
+    Samples that fail with transient errors go to the retry queue, which is
+    drained after the main pass. With ``retry_only`` only the queue is drained,
+    waiting for every pending retry.
+    """
+    journal = ResultJournal(results_file)
+    journal.recover()
+    moved = align_results(prompts_file, results_file)
+    if moved:
+        print(f"🔗 Re-attached {moved} results to their prompts by prompt_key")
+    queue = RetryQueue(results_file).load()
+
+    sample_counts = load_sample_counts(results_file)
+    rebuild_progress(results_file, load_model_status_counts(results_file))
+    update_progress(results_file, samples_per_task=config.SAMPLES_PER_TASK)
+    completed_tasks = {task for task, count in sample_counts.items() if count >= config.SAMPLES_PER_TASK}
+
+    if retry_only:
+        rows = iter(())
+    elif stopper:
+        # Adaptive ordering needs the whole prompt file to shuffle freelancers
+        df = stopper.prepare(pd.read_csv(prompts_file), results_file)
+        rows = zip(df.index, df.to_dict('records'))
+    else:
+        rows = iter_prompt_rows(prompts_file)
+    models = sync_models()
+    if not models:
+        return
+    stats = {'prompts': 0}
+    tasks = iter_pending_tasks(rows, completed_tasks, models, stats)
+    # Adaptive sampling relies on its own random freelancer order
+    if config.TASK_ORDER in ('longest_first', 'balanced') and not stopper:
+        tasks = order_by_cost(tasks, results_file, models)
+    elif config.TASK_ORDER == 'coverage' and not stopper and not retry_only:
+        tasks = order_by_coverage(prompts_file, completed_tasks, models, stats)
+
+    print(f"🚀 Processing {prompts_file} with {len(models)} models ({config.MAX_IN_FLIGHT} tasks in flight)")
+
+    def run_row(row_data, task_models):
+        return process_row(row_data, sample_counts, stopper, result_fields, task_models)
+
+    def run_retry_row(row_data, samples):
+        return process_retry_row(row_data, samples, result_fields)
+
+    dispatched = processed = 0
+    success_count = failed_count = 0
+    parked = {}
+    stopping = threading.Event()
+    previous_handlers = install_drain_handlers(stopping)
+
+    try:
+        with ThreadPoolExecutor(max_workers=config.MAX_WORKERS) as executor:
+            in_flight = {}
+
+            def fill_window(source, worker):
+                nonlocal dispatched
+                while len(in_flight) < config.MAX_IN_FLIGHT and not stopping.is_set():
+                    task = next(source, None)
+                    if task is None:
+                        return
+                    row_data, items = task
+                    in_flight[executor.submit(worker, row_data, items)] = row_data
+                    dispatched += 1
+
+            def drain(source, worker=run_row):
+                nonlocal processed, success_count, failed_count
+                fill_window(source, worker)
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task = in_flight.pop(future)
+                        if future.cancelled():
+                            continue
+                        processed += 1
+
+                        try:
+                            results, parked_models = future.result()
+                            if parked_models:
+                                parked[task[0]] = parked_models
+                            if results:
+                                journal.append(results)
+                                for result in results:
+                                    if result.get('attempt', 1) == 1:
+                                        sample_counts[(result['row_index'], result['model'])] += 1
+                                    queue.record(result)
+                                success_count += len([r for r in results if r['status'] == 'success'])
+                                failed_count += len([r for r in results if r['status'] != 'success'])
+                                if stopper:
+                                    stopper.record(task[1], results)
+
+                            journal.maybe_compact()
+
+                            if processed % 10 == 0:
+                                with stage('progress'):
+                                    print_progress(processed, dispatched, success_count, failed_count)
+
+                        except Exception as e:
+                            print(f"❌ Error: {e}")
+                            failed_count += 1
+
+                    if stopping.is_set():
+                        for pending in in_flight:
+                            pending.cancel()
+                    else:
+                        fill_window(source, worker)
+
+            drain(tasks)
+            if not dispatched and not queue.pending():
+                if not retry_only:
+                    update_progress(results_file, prompts=stats['prompts'])
+                print("✅ All tasks completed!")
+                return
+
+            # Re-dispatch parked tasks once their model's breaker lets probes through
+            while parked and wait_for_parked(parked, stopping):
+                retry, parked = parked, {}
+                print(f"🔁 Retrying {len(retry)} parked tasks")
+                drain(iter_parked_tasks(prompts_file, retry))
+
+            # Drain the retry queue, waiting up to RETRY_MAX_WAIT for delayed retries
+            max_wait = float('inf') if retry_only else config.RETRY_MAX_WAIT
+            while not stopping.is_set():
+                due = queue.due([m for m in models if get_breaker(m).available()])
+                if not due:
+                    if wait_for_retries(queue, [m for m in models if not get_breaker(m).exhausted()], max_wait, stopping):
+                        continue
+                    break
+                print(f"🔁 Retrying {len(due)} failed samples")
+                drain(iter_retry_tasks(prompts_file, due), run_retry_row)
+                queue.save()
+    finally:
+        # Save remaining results
+        journal.close()
+        save_latencies(results_file, models)
+        queue.save()
+        compacted = queue.compact()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+    if stopping.is_set():
+        print(f"🛑 Stopped early, results saved. {success_count} success, {failed_count} failed")
+        return
+
+    # A retry-only run never reads the prompts file, so keep the prompt count from the last full run
+    if not retry_only:
+        update_progress(results_file, prompts=stats['prompts'])
+    print(f"✅ Processing complete! {success_count} success, {failed_count} failed")
+
+    if queue.entries or queue.retried:
+        print_summary("RETRY QUEUE SUMMARY", {**queue.summary(), "Superseded rows removed": compacted})
+
+    if parked:
+        print_summary("CIRCUIT BREAKER SUMMARY", {
+            "Parked tasks left for the next run": len(parked),
+            **{f"Breaker {model}": state for model, state in breaker_states().items()}
+        })
+
+    if len(get_key_pool()) > 1:
+        print_summary("API KEY SUMMARY", get_key_pool().summary())
+
+    if stopper:
+        print_summary("ADAPTIVE SAMPLING SUMMARY", stopper.summary())
+
+    if n_shortfalls():
+        print_summary("SHORT n RESPONSES (topped up with single calls)", {
+            f"Samples missing for {model}": count for model, count in n_shortfalls().items()
+        })
+
+    if config.HEDGE_REQUESTS:
+        stats = hedge_stats()
+        print_summary("REQUEST HEDGING SUMMARY", {
+            "Hedge-eligible calls": stats['calls'],
+            "Hedged duplicates": stats['hedges'],
+            "Won by duplicate": stats['hedge_wins']
+        })
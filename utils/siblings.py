@@ -0,0 +1,186 @@
+"""Array-backed index of counterfactual siblings, for pairing results without merges."""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+from utils.data_loader import counterfactual_group
+from utils.file_utils import file_exists
+from utils.progress import print_summary
+
+ARRAYS = ('freelancer', 'group', 'value', 'reference_row', 'group_offsets', 'group_rows')
+
+
+def encode(labels: pd.Series, table: dict) -> np.ndarray:
+    """Integer codes of labels, adding unseen labels to the table in order of appearance."""
+    for label in pd.unique(labels):
+        table.setdefault(label, len(table))
+    return labels.map(table).to_numpy(np.int32)
+
+
+class SiblingIndex:
+    """Freelancer, counterfactual group, counterfactual value and reference sibling of every prompt row.
+
+    Built once into ``<prompts file>.siblings/`` as .npy arrays indexed by
+    row_index, memory-mapped on load, and rebuilt when the prompts file
+    changes. ``group_rows`` lists prompt rows sorted by group and
+    ``group_offsets`` slices it per group, so siblings are walked without
+    sorting or merging. Rows from before freelancer IDs existed are grouped by
+    their freelancer_index.
+    """
+
+    def __init__(self, prompts_file: str):
+        self.prompts_file = prompts_file
+        self.path = f"{prompts_file}.siblings"
+        self.labels_path = os.path.join(self.path, 'labels.json')
+
+    def source_stamp(self) -> list:
+        info = os.stat(self.prompts_file)
+        return [info.st_size, info.st_mtime_ns]
+
+    def stale(self) -> bool:
+        """Check whether the index is missing or older than the prompts file."""
+        if not file_exists(self.labels_path):
+            return True
+        with open(self.labels_path) as f:
+            return json.load(f)['source'] != self.source_stamp()
+
+    def build(self):
+        """Scan the prompts file in chunks and write the index arrays."""
+        columns = list(pd.read_csv(self.prompts_file, nrows=0).columns)
+        counterfactuals = [c for c in config.COUNTERFACTUAL_COLUMNS if c in columns]
+        wanted = ['freelancer_id', 'freelancer_index', 'group_id'] + config.VARIATION_COLUMNS
+        tables = {'freelancer': {}, 'group': {}, 'value': {}}
+        codes = {name: [] for name in tables}
+
+        for chunk in pd.read_csv(self.prompts_file, usecols=lambda c: c in wanted, dtype=str,
+                                 chunksize=config.PROMPT_CHUNK_SIZE):
+            legacy = pd.Series('row:' + chunk.index.astype(str), index=chunk.index)
+            if 'freelancer_index' in chunk:
+                legacy = ('index:' + chunk['freelancer_index']).fillna(legacy)
+            freelancers = chunk['freelancer_id'].fillna(legacy) if 'freelancer_id' in chunk else legacy
+            groups = chunk['group_id'].copy() if 'group_id' in chunk else pd.Series(np.nan, index=chunk.index, dtype=object)
+            missing = groups.isna()
+            if missing.any():
+                records = chunk[missing].dropna(axis=1, how='all').to_dict('records')
+                groups[missing] = [counterfactual_group(f, row) for f, row in zip(freelancers[missing], records)]
+
+            values = [chunk[c].fillna('') for c in counterfactuals] or [pd.Series('', index=chunk.index)]
+            values = values[0].str.cat(values[1:], sep='|') if len(values) > 1 else values[0]
+
+            codes['freelancer'].append(encode(freelancers, tables['freelancer']))
+            codes['group'].append(encode(groups, tables['group']))
+            codes['value'].append(encode(values, tables['value']))
+
+        arrays = {name: np.concatenate(parts) if parts else np.array([], dtype=np.int32) for name, parts in codes.items()}
+        group = arrays['group']
+        n_groups = len(tables['group'])
+
+        # Row of each group's reference sibling (-1 where the group has none)
+        reference = '|'.join(str(config.COUNTERFACTUAL_REFERENCES.get(c, '')) for c in counterfactuals)
+        reference_rows = np.flatnonzero(arrays['value'] == tables['value'].get(reference, -1))
+        reference_of_group = np.full(n_groups, -1, dtype=np.int64)
+        reference_of_group[group[reference_rows]] = reference_rows
+        arrays['reference_row'] = reference_of_group[group]
+
+        arrays['group_rows'] = np.argsort(group, kind='stable')
+        arrays['group_offsets'] = np.concatenate([[0], np.cumsum(np.bincount(group, minlength=n_groups))])
+
+        os.makedirs(self.path, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(self.path, f"{name}.npy"), arrays[name])
+        # Labels are written last and carry the source stamp, so a partial build reads as stale
+        with open(self.labels_path, 'w') as f:
+            json.dump({'source': self.source_stamp(), 'columns': counterfactuals, 'reference': reference,
+                       **{f"{name}s": list(table) for name, table in tables.items()}}, f)
+
+    def load(self):
+        """Build the index if needed and memory-map its arrays."""
+        if self.stale():
+            self.build()
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode='r'))
+        with open(self.labels_path) as f:
+            self.labels = json.load(f)
+        return self
+
+    def __len__(self):
+        return len(self.group)
+
+    def siblings(self, group: int) -> np.ndarray:
+        """Prompt rows of one counterfactual group."""
+        return self.group_rows[self.group_offsets[group]:self.group_offsets[group + 1]]
+
+    def rate_matrix(self, results_file: str) -> tuple[list, np.ndarray]:
+        """Models and a (models x prompt rows) matrix of mean successful rates, NaN where missing."""
+        df = pd.read_csv(results_file, usecols=['row_index', 'model', 'recommended_rate', 'status'])
+        rates = pd.to_numeric(df['recommended_rate'], errors='coerce')
+        keep = (df['status'] == 'success') & rates.notna() & (df['row_index'] < len(self))
+        models, model_codes = np.unique(df.loc[keep, 'model'].to_numpy(dtype=str), return_inverse=True)
+
+        cells = model_codes * len(self) + df.loc[keep, 'row_index'].to_numpy(np.int64)
+        size = len(models) * len(self)
+        counts = np.bincount(cells, minlength=size)
+        sums = np.bincount(cells, weights=rates[keep].to_numpy(), minlength=size)
+        with np.errstate(invalid='ignore'):
+            matrix = (sums / counts).reshape(len(models), len(self))
+        return models.tolist(), matrix
+
+    def iter_groups(self, results_file: str):
+        """Yield (group_id, model, {counterfactual value: rate}) for every group with results."""
+        models, matrix = self.rate_matrix(results_file)
+        groups, values = self.labels['groups'], self.labels['values']
+        for group in range(len(groups)):
+            rows = self.siblings(group)
+            for model, rates in zip(models, matrix[:, rows]):
+                answered = ~np.isnan(rates)
+                if answered.any():
+                    yield groups[group], model, {values[self.value[row]]: float(rate) for row, rate in zip(rows[answered], rates[answered])}
+
+    def deltas(self, results_file: str) -> pd.DataFrame:
+        """Each answered (prompt row, model) with its reference sibling's rate and the paired delta."""
+        models, matrix = self.rate_matrix(results_file)
+        reference_row = np.asarray(self.reference_row)
+        has_reference = reference_row >= 0
+
+        frames = []
+        for m, model in enumerate(models):
+            rates = matrix[m]
+            reference = np.where(has_reference, rates[np.where(has_reference, reference_row, 0)], np.nan)
+            rows = np.flatnonzero(~np.isnan(rates))
+            frames.append(pd.DataFrame({
+                'row_index': rows,
+                'model': model,
+                'freelancer': np.asarray(self.freelancer)[rows],
+                'group': np.asarray(self.group)[rows],
+                'value': np.asarray(self.value)[rows],
+                'rate': rates[rows],
+                'reference_rate': reference[rows],
+            }))
+        if not frames:
+            return pd.DataFrame(columns=['row_index', 'model', 'freelancer_id', 'group_id', 'counterfactual',
+                                         'rate', 'reference_rate', 'delta'])
+
+        df = pd.concat(frames, ignore_index=True)
+        df['delta'] = df['rate'] - df['reference_rate']
+        df['freelancer_id'] = pd.Categorical.from_codes(df.pop('freelancer'), self.labels['freelancers'])
+        df['group_id'] = pd.Categorical.from_codes(df.pop('group'), self.labels['groups'])
+        df['counterfactual'] = pd.Categorical.from_codes(df.pop('value'), self.labels['values'])
+        return df[['row_index', 'model', 'freelancer_id', 'group_id', 'counterfactual', 'rate', 'reference_rate', 'delta']]
+
+
+def paired_deltas(prompts_file: str, results_file: str) -> pd.DataFrame:
+    """Write per-row paired deltas to ``<results file>.deltas.csv`` and print mean deltas per model and value."""
+    index = SiblingIndex(prompts_file).load()
+    deltas = index.deltas(results_file)
+    deltas.to_csv(f"{results_file}.deltas.csv", index=False)
+
+    paired = deltas.dropna(subset=['delta'])
+    means = paired.groupby(['model', 'counterfactual'], observed=True)['delta'].agg(['mean', 'size'])
+    print_summary(f"PAIRED DELTAS vs {index.labels['reference'] or 'reference'} "
+                  f"({len(paired):,} paired of {len(deltas):,} answered rows)", {
+        f"{model} | {value}": f"{row['mean']:+.2f} USD ({int(row['size']):,} rows)" for (model, value), row in means.iterrows()
+    })
+    return deltas